@@ -46,6 +46,41 @@ class Game():
         """
         pass
 
+    def doAction(self, board, player, action):
+        """
+        In place getNextState followed by getCanonicalForm for the next player,
+        for search traversals that walk down and back up a single board.
+
+        Input:
+            board: current board, modified in place
+            player: current player (1 or -1)
+            action: action taken by current player
+
+        Returns:
+            nextPlayer: player who plays in the next turn (should be -player)
+        """
+        pass
+
+    def undoAction(self, board):
+        """
+        Input:
+            board: board modified by doAction
+
+        Reverts the last doAction on board.
+        """
+        pass
+
+    def copyBoard(self, board):
+        """
+        Input:
+            board: current board
+
+        Returns:
+            boardCopy: a copy of board that is not affected by later doAction
+                       and undoAction calls on board
+        """
+        pass
+
     def getValidActions(self, board, player):
         """
         Input:
@@ -3,7 +3,14 @@ import math
 
 import numpy as np
 
+from alphazero_general.NodeTable import NodeTable
+
 EPS = 1e-8
+# leaves evaluated together by default, see searchBatch. Batched forward
+# passes cost far less per position than single ones on CPU.
+BATCH_SIZE = 8
+# value counted against an edge while a simulation through it is pending
+VIRTUAL_LOSS = 1
 
 log = logging.getLogger(__name__)
 
@@ -17,28 +24,32 @@ class MCTS:
         self.game = game
         self.nnet = nnet
         self.args = args
-        self.Qsa = {}  # stores Q values for s,a (as defined in the paper)
-        self.Nsa = {}  # stores #times edge s,a was visited
-        self.Ns = {}  # stores #times board s was visited
-        self.Ps = {}  # stores initial policy (returned by neural net)
-
-        self.Es = {}  # stores game.getGameEnded ended for board s
-        self.Vs = {}  # stores game.getValidMoves for board s
+        # game.getGameEnded and visit count of each board s, and for the legal
+        # actions a of expanded boards the prior (returned by neural net), the
+        # visit count and value sum of edge s,a (Q = value sum / visit count)
+        self.tree = NodeTable()
 
     def getActionProb(self, canonicalBoard, temp=1):
         """
         This function performs numMCTSSims simulations of MCTS starting from
-        canonicalBoard.
+        canonicalBoard, evaluating the leaves by batches of args.mctsBatchSize
+        (BATCH_SIZE if unset, 1 for one leaf at a time).
 
         Returns:
             probs: a policy vector where the probability of the ith action is
                    proportional to Nsa[(s,a)]**(1./temp)
         """
-        for i in range(self.args.numMCTSSims):
-            self.search(canonicalBoard)
+        batch_size = self.args.get('mctsBatchSize', BATCH_SIZE)
+        if batch_size > 1:
+            sims = 0
+            while sims < self.args.numMCTSSims:
+                sims += self.searchBatch(canonicalBoard, min(batch_size, self.args.numMCTSSims - sims))
+        else:
+            for i in range(self.args.numMCTSSims):
+                self.search(canonicalBoard)
 
         s = self.game.stringRepresentation(canonicalBoard)
-        counts = [self.Nsa[(s, a)] if (s, a) in self.Nsa else 0 for a in range(self.game.getActionSize())]
+        counts = self.tree.counts(self.tree.find(s), self.game.getActionSize()).tolist()
 
         if temp == 0:
             bestAs = np.array(np.argwhere(counts == np.max(counts))).flatten()
@@ -54,15 +65,15 @@ class MCTS:
 
     def search(self, canonicalBoard):
         """
-        This function performs one iteration of MCTS. It is recursively called
-        till a leaf node is found. The action chosen at each node is one that
-        has the maximum upper confidence bound as in the paper.
+        This function performs one iteration of MCTS. It walks down the tree
+        till a leaf node is found, recording the path. The action chosen at each
+        node is one that has the maximum upper confidence bound as in the paper.
 
         Once a leaf node is found, the neural network is called to return an
         initial policy P and a value v for the state. This value is propagated
         up the search path. In case the leaf node is a terminal state, the
-        outcome is propagated up the search path. The values of Ns, Nsa, Qsa are
-        updated.
+        outcome is propagated up the search path. The visit counts and value
+        sums of the tree are updated.
 
         NOTE: the return values are the negative of the value of the current
         state. This is done since v is in [-1,1] and if v is the value of a
@@ -71,77 +82,133 @@ class MCTS:
         Returns:
             v: the negative of the value of the current canonicalBoard
         """
-
-        s = self.game.stringRepresentation(canonicalBoard)
-
-        if s not in self.Es:
-            self.Es[s] = self.game.getGameEnded(canonicalBoard, 1)
-        if self.Es[s] != 0:
+        tree = self.tree
+        path, node = self.descend(canonicalBoard)
+        if tree.ended[node] != 0:
             # terminal node
-            return -self.Es[s]
-
-        if s not in self.Ps:
+            v = -tree.ended[node]
+        else:
             # leaf node
-            self.Ps[s], v = self.nnet.predict(canonicalBoard)
-            valids = self.game.getValidActions(canonicalBoard, 1)
-            self.Ps[s] = self.Ps[s] * valids  # masking invalid moves
-            sum_Ps_s = np.sum(self.Ps[s])
+            p, v = self.nnet.predict(canonicalBoard)
+            self.expand(node, canonicalBoard, p)
+            # the torch wrappers return v as an array of shape (1,)
+            v = -float(np.ravel(v)[0])
+        self.ascend(canonicalBoard, path)
+        return self.backup(path, v)
+
+    def searchBatch(self, canonicalBoard, size):
+        """
+        Performs up to size simulations at once. Each descends from
+        canonicalBoard with a virtual loss added to the edges it walks, which
+        turns the next ones away from its path, until it reaches a terminal or
+        unexpanded node. The leaves are evaluated with one nnet.predict_batch
+        call, then every path is backed up. The batch stops early at a leaf
+        already reached in it.
 
-            if sum_Ps_s > 0:
-                self.Ps[s] /= sum_Ps_s  # renormalize
+        Returns:
+            sims: the number of simulations performed, at least 1
+        """
+        tree = self.tree
+        leaves, paths, boards = [], [], []
+        sims = 0
+        while sims < size:
+            path, node = self.descend(canonicalBoard, VIRTUAL_LOSS)
+            board = self.game.copyBoard(canonicalBoard) if tree.ended[node] == 0 else None
+            self.ascend(canonicalBoard, path)
+            if board is None:
+                # terminal node
+                self.backup(path, -tree.ended[node], VIRTUAL_LOSS)
+            elif node in leaves:
+                for parent, edge in path:
+                    tree.remove_virtual_loss(parent, edge, VIRTUAL_LOSS)
+                break
             else:
-                # if all valid moves were masked make all valid moves equally probable
-
-                # NB! All valid moves may be masked if either your NNet architecture is insufficient or you've get overfitting or something else.
-                # If you have got dozens or hundreds of these messages you should pay attention to your NNet and/or training process.   
-                log.error("All valid moves were masked, doing a workaround.")
-                self.Ps[s] = self.Ps[s] + valids
-                self.Ps[s] /= np.sum(self.Ps[s])
-
-            noise = np.random.dirichlet(self.args.dirichlet_alpha * np.ones(np.count_nonzero(valids)))
-            j = 0
-            for i, p in enumerate(self.Ps[s]):
-                if valids[i] > 0:
-                    self.Ps[s][i] = (1 - self.args.eps) * p + self.args.eps * noise[j]
-                    j += 1
-
-            self.Vs[s] = valids
-            self.Ns[s] = 0
-            return -v
-
-        valids = self.Vs[s]
-        cur_best = -float('inf')
-        best_act = -1
-        # pick the action with the highest upper confidence bound
-        for a in range(self.game.getActionSize()):
-            if valids[a]:
-                if (s, a) in self.Qsa:
-                    cpuct = self.args.cpuct_mult * math.log(
-                        (1 + self.Ns[s] + self.args.cpuct_base) / self.args.cpuct_base) + self.args.cpuct
-                    u = self.Qsa[(s, a)] + cpuct * self.Ps[s][a] * math.sqrt(self.Ns[s]) / (
-                            1 + self.Nsa[(s, a)])
-                else:
-                    cpuct = self.args.cpuct_mult * math.log(
-                        (1 + self.Ns[s] + self.args.cpuct_base) / self.args.cpuct_base) + self.args.cpuct
-                    u = cpuct * self.Ps[s][a] * math.sqrt(self.Ns[s] + EPS)  # Q = 0 ?
-
-                if u > cur_best:
-                    cur_best = u
-                    best_act = a
-
-        a = best_act
-        next_s, next_player = self.game.getNextState(canonicalBoard, 1, a)
-        next_s = self.game.getCanonicalForm(next_s, next_player)
-
-        v = self.search(next_s)
-
-        if (s, a) in self.Qsa:
-            self.Qsa[(s, a)] = (self.Nsa[(s, a)] * self.Qsa[(s, a)] + v) / (self.Nsa[(s, a)] + 1)
-            self.Nsa[(s, a)] += 1
+                leaves.append(node)
+                paths.append(path)
+                boards.append(board)
+            sims += 1
+
+        if leaves:
+            pis, vs = self.nnet.predict_batch(boards)
+            for node, path, board, p, v in zip(leaves, paths, boards, pis, vs):
+                self.expand(node, board, p)
+                self.backup(path, -v[0], VIRTUAL_LOSS)
+        return sims
+
+    def descend(self, canonicalBoard, virtual_loss=None):
+        """
+        Walks canonicalBoard down the tree, in place, along the edges of highest
+        upper confidence bound until a terminal or unexpanded node, adding
+        virtual_loss to each edge if given. ascend walks it back up.
 
+        Returns:
+            path: the (node, edge) pairs walked through
+            node: the node reached
+        """
+        tree = self.tree
+        path = []
+        while True:
+            s = self.game.stringRepresentation(canonicalBoard)
+            node = tree.find(s)
+            if node is None:
+                node = tree.add(s, self.game.getGameEnded(canonicalBoard, 1))
+            if tree.ended[node] != 0 or not tree.is_expanded(node):
+                return path, node
+            edge = self.select(node)
+            if virtual_loss is not None:
+                tree.add_virtual_loss(node, edge, virtual_loss)
+            path.append((node, edge))
+            self.game.doAction(canonicalBoard, 1, int(tree.actions[edge]))
+
+    def ascend(self, canonicalBoard, path):
+        """
+        Restores canonicalBoard walked down path by descend
+        """
+        for _ in path:
+            self.game.undoAction(canonicalBoard)
+
+    def backup(self, path, v, virtual_loss=None):
+        """
+        Backs up v, the negative of the value of the node reached at the end of
+        path, through its (node, edge) pairs, replacing virtual_loss if they
+        hold one.
+
+        Returns:
+            v: the negative of the value of the node path starts from
+        """
+        for node, edge in reversed(path):
+            self.tree.backup(node, edge, v, virtual_loss)
+            v = -v
+        return v
+
+    def select(self, node):
+        """
+        Edge of the expanded node with the highest upper confidence bound
+        """
+        visits = int(self.tree.visits[node])
+        cpuct = self.args.cpuct_mult * math.log(
+            (1 + visits + self.args.cpuct_base) / self.args.cpuct_base) + self.args.cpuct
+        return self.tree.select(node, cpuct, EPS)
+
+    def expand(self, node, board, p):
+        """
+        Creates the edges of the leaf node, whose board is board, with the
+        policy p returned by the neural net, masked and renormalized
+        """
+        legal = np.flatnonzero(self.game.getValidActions(board, 1))
+        Ps = p[legal]  # masking invalid moves
+        sum_Ps_s = np.sum(Ps)
+
+        if sum_Ps_s > 0:
+            Ps /= sum_Ps_s  # renormalize
         else:
-            self.Qsa[(s, a)] = v
-            self.Nsa[(s, a)] = 1
+            # if all valid moves were masked make all valid moves equally probable
+
+            # NB! All valid moves may be masked if either your NNet architecture is insufficient or you've get overfitting or something else.
+            # If you have got dozens or hundreds of these messages you should pay attention to your NNet and/or training process.   
+            log.error("All valid moves were masked, doing a workaround.")
+            Ps = Ps + 1
+            Ps /= np.sum(Ps)
 
-        self.Ns[s] += 1
-        return -v
+        noise = np.random.dirichlet(self.args.dirichlet_alpha * np.ones(len(legal)))
+        self.tree.expand(node, legal, (1 - self.args.eps) * Ps + self.args.eps * noise)
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class NeuralNet():
     """
     This class specifies the base NeuralNet class. To define your own neural
@@ -36,6 +39,22 @@ class NeuralNet():
         """
         pass
 
+    def predict_batch(self, boards):
+        """
+        Input:
+            boards: list of boards in their canonical form.
+
+        Returns:
+            pis: the policy vectors of the boards, shaped (len(boards),
+                 game.getActionSize)
+            vs: their values, shaped (len(boards), 1)
+
+        Calls predict on each board by default. Override it with a single
+        batched evaluation where the network allows it.
+        """
+        pis, vs = zip(*(self.predict(board) for board in boards))
+        return np.array(pis), np.reshape(vs, (len(boards), 1))
+
     def save_checkpoint(self, folder, filename):
         """
         Saves the current neural network (with its parameters) in
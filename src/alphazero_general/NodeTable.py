@@ -0,0 +1,172 @@
+import math
+
+import numpy as np
+
+# edges from which select scores a node with NumPy rather than a Python loop
+_VECTOR_EDGES = 32
+
+
+class NodeTable:
+    """
+    Statistics of an MCTS tree in flat NumPy arrays, in place of dicts keyed by
+    state and by (state, action).
+
+    Every state gets an integer node id on its first visit, with its
+    game.getGameEnded value and visit count. Expanding a node gives each of its
+    legal actions an edge in a contiguous run, holding the action, its prior,
+    its visit count and the sum of the values backed up through it, 18 bytes
+    in all. Priors are stored as float32 and actions as int16. Arrays grow by
+    half their size.
+    """
+
+    def __init__(self, nodes=1024, edges=16384):
+        self.ids = {}  # node id of each state
+        self.num_nodes = 0
+        self.num_edges = 0
+
+        # per node
+        self.ended = np.zeros(nodes)  # game.getGameEnded of the state
+        self.visits = np.zeros(nodes, np.int32)
+        self.first = np.full(nodes, -1, np.int64)  # first edge, -1 until expanded
+        self.count = np.zeros(nodes, np.int32)  # number of edges
+
+        # per edge
+        self.actions = np.zeros(edges, np.int16)
+        self.priors = np.zeros(edges, np.float32)
+        self.edge_visits = np.zeros(edges, np.int32)
+        self.value_sums = np.zeros(edges)
+
+    def __len__(self):
+        return self.num_nodes
+
+    def find(self, s):
+        """
+        Node id of state s, or None if it was never visited
+        """
+        return self.ids.get(s)
+
+    def add(self, s, ended):
+        """
+        Adds state s, whose game.getGameEnded value is ended, and returns its id
+        """
+        node = self.num_nodes
+        if node == len(self.ended):
+            self.ended, self.visits, self.first, self.count = _grow(
+                node, self.ended, self.visits, self.first, self.count)
+            self.first[node:] = -1
+        self.ended[node] = ended
+        self.ids[s] = node
+        self.num_nodes += 1
+        return node
+
+    def is_expanded(self, node):
+        return self.first[node] >= 0
+
+    def expand(self, node, actions, priors):
+        """
+        Creates the edges of node for the legal actions, an increasing array of
+        action indices, with their priors. Returns the slice of its edges.
+        """
+        first = self.num_edges
+        end = first + len(actions)
+        if end > len(self.actions):
+            self.actions, self.priors, self.edge_visits, self.value_sums = _grow(
+                end, self.actions, self.priors, self.edge_visits, self.value_sums)
+        self.actions[first:end] = actions
+        self.priors[first:end] = priors
+        self.first[node] = first
+        self.count[node] = len(actions)
+        self.num_edges = end
+        return slice(first, end)
+
+    def edges(self, node):
+        """
+        Slice of the edges of an expanded node, in increasing action order
+        """
+        first = self.first[node]
+        return slice(first, first + self.count[node])
+
+    def backup(self, node, edge, v, virtual_loss=None):
+        """
+        Records a simulation through edge of node that returned value v. If it
+        holds a virtual loss, its visit is already counted and only the loss is
+        replaced by v.
+        """
+        if virtual_loss is None:
+            self.edge_visits[edge] += 1
+            self.value_sums[edge] += v
+            self.visits[node] += 1
+        else:
+            self.value_sums[edge] += v + virtual_loss
+
+    def add_virtual_loss(self, node, edge, loss):
+        """
+        Counts a pending simulation through edge of node as a visit that lost
+        loss, until backup or remove_virtual_loss
+        """
+        self.edge_visits[edge] += 1
+        self.value_sums[edge] -= loss
+        self.visits[node] += 1
+
+    def remove_virtual_loss(self, node, edge, loss):
+        self.edge_visits[edge] -= 1
+        self.value_sums[edge] += loss
+        self.visits[node] -= 1
+
+    def select(self, node, cpuct, eps):
+        """
+        Edge of an expanded node with the highest upper confidence bound
+        Q + cpuct * P * sqrt(N) / (1 + n), the first one on ties. An unvisited
+        edge scores cpuct * P * sqrt(N + eps). Nodes with few edges are scanned
+        in Python, where NumPy's per call overhead would dominate.
+        """
+        edges = self.edges(node)
+        visits = int(self.visits[node])
+        sqrt_visits = math.sqrt(visits)
+        if edges.stop - edges.start < _VECTOR_EDGES:
+            best, edge = -math.inf, edges.start
+            for i, (p, n, w) in enumerate(zip(self.priors[edges].tolist(), self.edge_visits[edges].tolist(),
+                                              self.value_sums[edges].tolist())):
+                u = w / n + cpuct * p * sqrt_visits / (1 + n) if n else cpuct * p * math.sqrt(visits + eps)
+                if u > best:
+                    best, edge = u, edges.start + i
+            return edge
+
+        explore = cpuct * self.priors[edges].astype(np.float64)
+        n = self.edge_visits[edges].astype(np.float64)
+        if n.all():
+            u = self.value_sums[edges] / n + explore * sqrt_visits / (n + 1)
+        else:
+            u = np.where(n > 0, self.value_sums[edges] / np.maximum(n, 1.) + explore * sqrt_visits / (n + 1),
+                         explore * math.sqrt(visits + eps))
+        return edges.start + int(np.argmax(u))
+
+    def counts(self, node, action_size):
+        """
+        Visit counts of every action of node, 0 for illegal actions
+        """
+        counts = np.zeros(action_size, np.int64)
+        if node is not None and self.is_expanded(node):
+            edges = self.edges(node)
+            counts[self.actions[edges]] = self.edge_visits[edges]
+        return counts
+
+    def nbytes(self):
+        """
+        Memory held by the arrays, the dict of node ids excluded
+        """
+        return sum(array.nbytes for array in (self.ended, self.visits, self.first, self.count, self.actions,
+                                              self.priors, self.edge_visits, self.value_sums))
+
+
+def _grow(size, *arrays):
+    """
+    Copies of arrays with room for at least size entries, zero filled
+    """
+    capacity = max(size, len(arrays[0]) * 3 // 2)
+    grown = []
+    for array in arrays:
+        new = np.zeros(capacity, array.dtype)
+        new[:len(array)] = array
+        grown.append(new)
+    return grown
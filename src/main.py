@@ -19,6 +19,7 @@ args = dotdict({
     'updateThreshold': 0.60,
     'maxlenOfQueue': 200000,
     'numMCTSSims': 300,
+    'mctsBatchSize': 8,
     'arenaCompare': 40,
     'cpuct': 3,
     'cpuct_base': 19652,
@@ -6,13 +6,17 @@ import numpy as np
 sys.path.append(os.path.join(os.path.dirname(__file__), 'pathfind/build'))
 
 from alphazero_general.Game import Game
-from .QuoridorLogic import QuoridorBoard
+from .QuoridorLogic import QuoridorBoard, actionTables, encodeBoards, featureBuffers
 
 
 class QuoridorGame(Game):
-    def __init__(self, n):
+    def __init__(self, n, check_keys=False):
         super().__init__()
         self.n = n
+        # Debug mode: verify that Zobrist keys never collide, at the cost of
+        # keeping every position seen
+        self.check_keys = check_keys
+        self.key_positions = {}
         self.action_size = 12 + 2 * (self.n - 1) ** 2
         self.board_len = 2 * self.n - 1
 
@@ -49,10 +53,32 @@ class QuoridorGame(Game):
             nextBoard: board after applying action
             nextPlayer: player who plays in the next turn (should be -player)
         """
-        next_board = QuoridorBoard(self.n, board=board)
+        next_board = board.clone()
         next_board.executeAction(player, action)
         return next_board, -player
 
+    def doAction(self, board, player, action):
+        """
+        Input:
+            board: current board, modified in place
+            player: current player (1 or -1)
+            action: action taken by current player
+
+        Returns:
+            nextPlayer: player who plays in the next turn. board is left in
+                        its canonical form, undoAction restores it.
+        """
+        board.doAction(player, action)
+        board.makeCanonical(-player)
+        return -player
+
+    def undoAction(self, board):
+        board.undoAction()
+
+    def copyBoard(self, board):
+        # One copy of the state buffer, the history is shared
+        return board.clone()
+
     def getValidActions(self, board, player):
         """
         Input:
@@ -62,10 +88,23 @@ class QuoridorGame(Game):
         Returns:
             validMoves: a binary vector of length self.getActionSize(), 1 for
                         moves that are valid from the current board and player,
-                        0 for invalid moves
+                        0 for invalid moves. Here a read-only uint8 array,
+                        shared by every call on the same position.
         """
         return board.getValidActions(player)
 
+    def getLegalActions(self, board, player):
+        """
+        Input:
+            board: current board
+            player: current player
+
+        Returns:
+            legalActions: read-only array of the indices of the valid moves,
+                          the nonzero entries of getValidActions
+        """
+        return board.legalActions(player)
+
     def getGameEnded(self, board, player):
         """
         Input:
@@ -93,8 +132,8 @@ class QuoridorGame(Game):
                             board as is. When the player is black, we can invert
                             the colors and return the board.
         """
-        next_board = QuoridorBoard(self.n, board=board)
-        return next_board.makeCanonical(player)
+        # A view sharing the state of board, nothing is copied
+        return board.view().makeCanonical(player)
 
     def getSymmetries(self, board, pi):
         """
@@ -107,17 +146,11 @@ class QuoridorGame(Game):
                        form of the board and the corresponding pi vector. This
                        is used when training the neural network from examples.
         """
-        pawn_moves = 12
-        vwa_size = pawn_moves + (self.n - 1) ** 2
-        vw_actions = list(np.flipud(np.array(pi[pawn_moves:vwa_size]).reshape(self.n - 1, self.n - 1)).flatten())
-        hw_actions = list(np.flipud(np.array(pi[vwa_size:]).reshape(self.n - 1, self.n - 1)).flatten())
-        pi2 = pi[:12] + vw_actions + hw_actions
-
-        pi2[2], pi2[3] = pi2[3], pi2[2]
-        pi2[6], pi2[7] = pi2[7], pi2[6]
-        pi2[8], pi2[10] = pi2[10], pi2[8]
-        pi2[9], pi2[11] = pi2[9], pi2[11]
-        return [(board.getBoard(), pi), (board.getBoardFlippedHorizontally(), pi2)]
+        # getBoard and getBoardFlippedHorizontally features in a single pass
+        planes, walls, values = featureBuffers(self.n, 2)
+        encodeBoards([board], planes, walls, values, mirror=True)
+        pi2 = np.asarray(pi)[actionTables(self.n).mirror].tolist()
+        return [((planes[0], walls[0], values[0]), pi), ((planes[1], walls[1], values[1]), pi2)]
 
     def stringRepresentation(self, board):
         """
@@ -126,9 +159,14 @@ class QuoridorGame(Game):
 
         Returns:
             boardString: a quick conversion of board to a string format.
-                         Required by MCTS for hashing.
-        """
-        return board.getBoardHashable()
+                         Required by MCTS for hashing. Here the Zobrist key
+                         of the board, an int.
+        """
+        key = board.getBoardKey()
+        if self.check_keys:
+            position = self.key_positions.setdefault(key, board.getBoardHashable())
+            assert position == board.getBoardHashable(), 'Zobrist key collision: ' + str(key)
+        return key
 
     def display(self, board, name=None, save_folder=None, save=True):
         board.plot(name=name, save_folder=save_folder, save=save)
@@ -1,9 +1,10 @@
-import copy
+import functools
+import math
 import os
+import struct
 import sys
 
 import numpy as np
-from functools import partial
 
 from matplotlib import patches
 import matplotlib.pyplot as plt
@@ -11,13 +12,184 @@ import matplotlib.pyplot as plt
 sys.path.append(os.path.join(os.path.dirname(__file__), 'pathfind/build'))
 import QuoridorUtils
 
+# Zobrist key in the state header, a uint64 in native byte order
+KEY_FORMAT = struct.Struct('=Q')
+
+
+@functools.lru_cache(maxsize=None)
+def stateFields(n):
+    """
+    Offsets and shapes of the fields of the int16 state buffer shared with
+    QuoridorUtils, computed once per board size.
+    """
+    layout = QuoridorUtils.stateLayout(n)
+    m = n - 1
+    fields = {
+        'paths_red': (layout['paths_red'], (n, n)),
+        'paths_blue': (layout['paths_blue'], (n, n)),
+        'legal_vwalls': (layout['legal_walls'], (m, m)),
+        'legal_hwalls': (layout['legal_walls'] + m * m, (m, m)),
+        'valid_red': (layout['valid_red'], (layout['action_size'],)),
+        'valid_blue': (layout['valid_blue'], (layout['action_size'],)),
+    }
+    # Bit y * n + x of the packed wall masks, in [x][y] order
+    bits = np.arange(m)[None, :] * n + np.arange(m)[:, None]
+    return layout, fields, bits
+
+
+class ActionTables:
+    """
+    Action tables of an n x n board, shared by every board of that size through
+    actionTables(n).
+    """
+
+    # Pawn steps in action order: N, S, E, W, JN, JS, JE, JW, JNE, JSW, JNW, JSE
+    PAWN_DX = np.array([0, 0, 1, -1, 0, 0, 2, -2, 1, -1, -1, 1])
+    PAWN_DY = np.array([1, -1, 0, 0, 2, -2, 0, 0, 1, -1, 1, -1])
+
+    def __init__(self, n):
+        m = n - 1
+        walls = np.arange(m * m).reshape(m, m)
+        self.action_size = 12 + 2 * m * m
+        self.dx = self.PAWN_DX
+        self.dy = self.PAWN_DY
+        # Action of the flipped board (rotated by 180 degrees): pawn moves swap
+        # with their opposite, wall indices are reversed
+        pawn_flip = np.arange(12) ^ 1
+        self.flip = np.concatenate([pawn_flip, 12 + walls.ravel()[::-1], 12 + m * m + walls.ravel()[::-1]])
+        # Action of the board mirrored along x, as used by the symmetries: E and
+        # W, JE and JW, JNE and JNW swap, walls are flipped along x
+        pawn_mirror = np.array([0, 1, 3, 2, 4, 5, 7, 6, 10, 9, 8, 11])
+        wall_mirror = np.flipud(walls).ravel()
+        self.mirror = np.concatenate([pawn_mirror, 12 + wall_mirror, 12 + m * m + wall_mirror])
+
+
+@functools.lru_cache(maxsize=None)
+def actionTables(n):
+    return ActionTables(n)
+
+
+def featureBuffers(n, count):
+    """
+    Zeroed float32 buffers for the network input of count boards: pawn planes,
+    placed walls and values, shaped as returned by getBoard with a leading
+    batch axis. They are C-contiguous, so torch.from_numpy wraps them as is.
+    """
+    m = n - 1
+    return (np.zeros((count, 2, n, n), np.float32), np.zeros((count, 2, m, m), np.float32),
+            np.zeros((count, 17), np.float32))
+
+
+def encodeBoards(boards, planes, walls, values, mirror=False):
+    """
+    Writes the getBoard features of boards, as float32, into the first rows of
+    buffers from featureBuffers, in a single QuoridorUtils call. With mirror,
+    the getBoardFlippedHorizontally features of board i are also written to
+    row len(boards) + i.
+    """
+    # A single board, as in predict, is encoded without copying its state
+    states = boards[0].state[None] if len(boards) == 1 else np.stack([board.state for board in boards])
+    QuoridorUtils.encodeStates(states, boards[0].n, [board.perspective for board in boards],
+                               [board.draw for board in boards], planes, walls, values, mirror)
+
+
+class StateField:
+    """
+    Array attribute of a QuoridorBoard, created on access as a view of its
+    state buffer so that boards hold no array other than the state. From the
+    other player's perspective the field reads mirror, the same field of the
+    other color, rotated by 180 degrees: a reversed view for board arrays, the
+    flip permutation for actions.
+    """
+
+    def __init__(self, mirror=None, actions=False):
+        self.mirror = mirror
+        self.actions = actions
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.mirror = self.mirror or name
+
+    def __get__(self, board, owner=None):
+        if board is None:
+            return self
+        fields = stateFields(board.n)[1]
+        if board.perspective == 1:
+            start, shape = fields[self.name]
+            return board.state[start:start + math.prod(shape)].reshape(shape)
+        start, shape = fields[self.mirror]
+        data = board.state[start:start + math.prod(shape)]
+        if self.actions:
+            return data[actionTables(board.n).flip]
+        return data[::-1].reshape(shape)
+
+
+class PositionHistory:
+    """
+    Persistent record of the positions reached in a game, as a chain of keys
+    linked to the previous one. A board extends the chain of its parent without
+    copying it, so every board of a search tree shares its ancestors' chain.
+    count is the number of times key occurs in the chain up to this link.
+    """
+    __slots__ = ('key', 'count', 'parent')
+
+    def __init__(self, key, parent=None):
+        self.key = key
+        self.parent = parent
+        self.count = 1
+        node = parent
+        while node is not None:
+            if node.key == key:
+                self.count = node.count + 1
+                break
+            node = node.parent
+
+
+class PositionMemo:
+    """
+    Data derived from one position, computed on first use and shared by the
+    views of a board until the position changes, see QuoridorBoard.positionMemo.
+    The arrays are read-only, except the network input handed to torch.
+    """
+    __slots__ = ('key', 'features', 'valids', 'legal')
+
+    def __init__(self, key):
+        self.key = key
+        # float32 network input, see QuoridorBoard.features
+        self.features = None
+        # uint8 valid-action masks and legal action indices, by player
+        self.valids = {}
+        self.legal = {}
+
 
 class QuoridorBoard:
+    __slots__ = ('n', 'history', 'red_goal', 'blue_goal', 'perspective', 'max_walls', 'state', 'draw',
+                 'undo_states', 'undo_info', 'memo')
+
+    # Update legal walls from the previous position instead of recomputing them
+    incremental_walls = True
+
+    # Distances to the goal rows, legal walls and valid actions of each player,
+    # kept up to date by QuoridorUtils when actions are applied
+    paths_red = StateField('paths_blue')
+    paths_blue = StateField('paths_red')
+    legal_vwalls = StateField()
+    legal_hwalls = StateField()
+    valid_red = StateField('valid_blue', actions=True)
+    valid_blue = StateField('valid_red', actions=True)
+
     def __init__(self, n, board=None):
         assert n >= 3
 
         self.n = n
-        self.history = {}
+        # last PositionHistory link, None before the first move
+        self.history = None
+        # states saved by doAction, allocated on first use and grown by doubling
+        self.undo_states = None
+        # history, draw and perspective saved by doAction
+        self.undo_info = []
+        # PositionMemo of the last position queried
+        self.memo = None
 
         midpoint_red = self.n // 2 + 1 - n % 2
         midpoint_blue = self.n // 2 - 1 + n % 2
@@ -25,191 +197,164 @@ class QuoridorBoard:
 
         self.red_goal = lastpoint
         self.blue_goal = 0
-        self.is_flipped = False
+        # 1 for the board as played, -1 for the view of the blue player, turned
+        # around so that blue plays red. The state itself is never turned.
+        self.perspective = 1
 
         self.max_walls = (self.n + 1) ** 2 // 10
         if board:
             self.setBoard(board)
         else:
-            self.v_walls = np.zeros((self.n - 1, self.n - 1), np.int16)
-            self.h_walls = np.zeros((self.n - 1, self.n - 1), np.int16)
+            self.state = np.zeros(self.layout['size'], np.int16)
             self.draw = False
 
-            self.paths_red, self.paths_blue = QuoridorUtils.getPathMatrices(self.v_walls, self.h_walls)
-            self.legal_vwalls = np.ones((self.n - 1, self.n - 1), np.int16)
-            self.legal_hwalls = np.ones((self.n - 1, self.n - 1), np.int16)
-
             # red player
-            self.red_position = (midpoint_red, 0)
-            self.red_walls = self.max_walls
+            self.state[QuoridorUtils.RED_X], self.state[QuoridorUtils.RED_Y] = midpoint_red, 0
+            self.state[QuoridorUtils.RED_WALLS] = self.max_walls
 
             # blue player
-            self.blue_position = (midpoint_blue, lastpoint)
-            self.blue_walls = self.max_walls
-
-        self.actions = {
-            # NORTH
-            0: partial(self.move, dx=+0, dy=+1),
-            # SOUTH
-            1: partial(self.move, dx=+0, dy=-1),
-            # EAST
-            2: partial(self.move, dx=+1, dy=+0),
-            # WEST
-            3: partial(self.move, dx=-1, dy=+0),
-            # JN
-            4: partial(self.move, dx=+0, dy=+2),
-            # JS
-            5: partial(self.move, dx=+0, dy=-2),
-            # JE
-            6: partial(self.move, dx=+2, dy=+0),
-            # JW
-            7: partial(self.move, dx=-2, dy=+0),
-            # JNE
-            8: partial(self.move, dx=+1, dy=+1),
-            # JSW
-            9: partial(self.move, dx=-1, dy=-1),
-            # JNW
-            10: partial(self.move, dx=-1, dy=+1),
-            # JSE
-            11: partial(self.move, dx=+1, dy=-1),
-            # PLACE VERTICAL WALL
-            'vw': self.placeVerticalWall,
-            # PLACE HORIZONTAL WALL
-            'hw': self.placeHorizontalWall,
-        }
-
-        self.convert_action = [1, 0, 3, 2, 5, 4, 7, 6, 9, 8, 11, 10] + list(
-            np.flip(np.arange(12, 12 + (self.n - 1) ** 2).reshape((self.n - 1, self.n - 1)), (0, 1)).ravel()) + list(
-            np.flip(np.arange(12 + (self.n - 1) ** 2, 12 + 2 * (self.n - 1) ** 2).reshape((self.n - 1, self.n - 1)),
-                    (0, 1)).ravel())
+            self.state[QuoridorUtils.BLUE_X], self.state[QuoridorUtils.BLUE_Y] = midpoint_blue, lastpoint
+            self.state[QuoridorUtils.BLUE_WALLS] = self.max_walls
+
+            QuoridorUtils.refreshState(self.state, self.n)
+
+    def clone(self):
+        """
+        Copy of the board for a child position: one copy of the state buffer,
+        the history is shared.
+        """
+        return self.view(self.state.copy())
+
+    def view(self, state=None):
+        """
+        Board sharing the state buffer (or using state), whose perspective can
+        be changed without affecting this one.
+        """
+        board = QuoridorBoard.__new__(QuoridorBoard)
+        board.n = self.n
+        board.history = self.history
+        board.red_goal = self.red_goal
+        board.blue_goal = self.blue_goal
+        board.perspective = self.perspective
+        board.max_walls = self.max_walls
+        board.state = self.state if state is None else state
+        board.draw = self.draw
+        board.undo_states = None
+        board.undo_info = []
+        board.memo = self.memo
+        return board
+
+    @property
+    def is_flipped(self):
+        return self.perspective == -1
+
+    @property
+    def origin(self):
+        """
+        Offset of the header and walls of the board seen from its perspective
+        """
+        return 0 if self.perspective == 1 else self.layout['mirror']
+
+    @property
+    def layout(self):
+        """
+        Offsets of the fields of the int16 state buffer shared with QuoridorUtils
+        """
+        return stateFields(self.n)[0]
+
+    def unpackWalls(self, offset):
+        words = self.layout['words']
+        packed = self.state[offset:offset + words].view(np.uint8)
+        return np.unpackbits(packed, bitorder='little')[stateFields(self.n)[2]].astype(np.int16)
+
+    @property
+    def v_walls(self):
+        return self.unpackWalls(self.origin + self.layout['walls'])
+
+    @property
+    def h_walls(self):
+        return self.unpackWalls(self.origin + self.layout['walls'] + self.layout['words'])
+
+    @property
+    def red_position(self):
+        origin = self.origin
+        return int(self.state[origin + QuoridorUtils.RED_X]), int(self.state[origin + QuoridorUtils.RED_Y])
+
+    @property
+    def blue_position(self):
+        origin = self.origin
+        return int(self.state[origin + QuoridorUtils.BLUE_X]), int(self.state[origin + QuoridorUtils.BLUE_Y])
+
+    @property
+    def red_walls(self):
+        return int(self.state[self.origin + QuoridorUtils.RED_WALLS])
+
+    @property
+    def blue_walls(self):
+        return int(self.state[self.origin + QuoridorUtils.BLUE_WALLS])
 
     def getGameEnded(self, player):
-        # endgame_heuristic = True
-        # if endgame_heuristic:
-        #     dist_red = self.paths_red[self.red_position[0]][self.red_position[1]]
-        #     dist_blue = self.paths_blue[self.blue_position[0]][self.blue_position[1]]
-        #
-        #     if player == 1 and self.red_walls == 0 and self.blue_walls == 0 and dist_red < dist_blue:
-        #         return player
-        #     if player == -1 and self.red_walls == 0 and self.blue_walls == 0 and dist_blue < dist_red:
-        #         return -player
-
         if self.red_position[1] == self.red_goal:
             return player
         elif self.blue_position[1] == self.blue_goal:
             return -player
         elif self.draw:
             return -1e-3
+        elif self.red_walls == 0 and self.blue_walls == 0:
+            # Without walls left the game is a pawn race, decided as soon as it starts
+            return self.raceResult(player)
         return 0
 
-    def addToHistory(self):
-        s = self.getBoardHashable()
-        if s in self.history:
-            self.history[s] += 1
-        else:
-            self.history[s] = 1
+    def raceResult(self, player):
+        """
+        Outcome of the pawn race left once both players are out of walls, for
+        player (1 for red) to move: 1 if it wins with best play, -1 if it
+        loses, 0 if neither can force a win. Solved exactly by QuoridorUtils,
+        jumps and blocking included, once per wall configuration.
+        """
+        return QuoridorUtils.raceResult(self.state, self.n, self.perspective, player == 1)
 
-        if self.history[s] > 2:
+    def addToHistory(self):
+        self.history = PositionHistory(self.getBoardHashable(), self.history)
+        if self.history.count > 2:
             self.draw = True
 
+    def positionMemo(self):
+        """
+        PositionMemo of the current position. It is checked against the
+        Zobrist key, so it is dropped when the state changes, through this
+        board or any view of it, or the perspective or draw flag does.
+        """
+        key = self.getBoardKey()
+        if self.memo is None or self.memo.key != key:
+            self.memo = PositionMemo(key)
+        return self.memo
+
+    def features(self):
+        """
+        Network input of the position as float32 pawn planes, placed walls and
+        values, each with a leading batch axis of 1, encoded once per position.
+        The arrays are shared, do not write to them.
+        """
+        memo = self.positionMemo()
+        if memo.features is None:
+            memo.features = featureBuffers(self.n, 1)
+            encodeBoards([self], *memo.features)
+        return memo.features
+
     def getBoard(self):
-        # Boards
-        boards = np.zeros((2, self.n, self.n), dtype=int)
-        # Red position
-        red_board = np.zeros((self.n, self.n))
-        red_board[self.red_position[0], self.red_position[1]] = 1
-        boards[0] = red_board
-        # Blue position
-        blue_board = np.zeros((self.n, self.n))
-        blue_board[self.blue_position[0], self.blue_position[1]] = 1
-        boards[1] = blue_board
-
-        # Walls
-        walls = np.zeros((2, self.n - 1, self.n - 1), dtype=int)
-        walls[0] = self.v_walls
-        walls[1] = self.h_walls
-
-        # Values
-        values = np.append(self.shortestPathActions(),
-                           [self.red_walls / self.max_walls, self.blue_walls / self.max_walls,
-                            ((self.n ** 2 + 1) - self.paths_red[self.red_position[0]][self.red_position[1]]) / (
-                                    self.n ** 2 + 1),
-                            ((self.n ** 2 + 1) - self.paths_blue[self.blue_position[0]][self.blue_position[1]]) / (
-                                    self.n ** 2 + 1),
-                            float(self.draw)])
-        return boards, walls, values
+        # Pawn planes, placed walls and values, as fed to the network
+        planes, walls, values = self.features()
+        return planes[0], walls[0], values[0]
 
     def getBoardFlippedHorizontally(self):
-        # Boards
-        boards = np.zeros((2, self.n, self.n), dtype=int)
-        # Red position
-        red_board = np.zeros((self.n, self.n))
-        red_board[(self.n - 1) - self.red_position[0], self.red_position[1]] = 1
-        boards[0] = red_board
-        # Blue position
-        blue_board = np.zeros((self.n, self.n))
-        blue_board[(self.n - 1) - self.blue_position[0], self.blue_position[1]] = 1
-        boards[1] = blue_board
-
-        # Walls
-        walls = np.zeros((2, self.n - 1, self.n - 1), dtype=int)
-        walls[0] = np.flipud(self.v_walls)
-        walls[1] = np.flipud(self.h_walls)
-
-        # Values
-        spa = self.shortestPathActions()
-        spa[2], spa[3] = spa[3], spa[2]
-        spa[6], spa[7] = spa[7], spa[6]
-        spa[8], spa[10] = spa[10], spa[8]
-        spa[9], spa[11] = spa[9], spa[11]
-        values = np.append(spa,
-                           [self.red_walls / self.max_walls, self.blue_walls / self.max_walls,
-                            ((self.n ** 2 + 1) - self.paths_red[(self.n - 1) - self.red_position[0]][
-                                self.red_position[1]]) / (self.n ** 2 + 1),
-                            ((self.n ** 2 + 1) - self.paths_blue[(self.n - 1) - self.blue_position[0]][
-                                self.blue_position[1]]) / (self.n ** 2 + 1),
-                            float(self.draw)])
-        return boards, walls, values
+        planes, walls, values = featureBuffers(self.n, 2)
+        encodeBoards([self], planes, walls, values, mirror=True)
+        return planes[1], walls[1], values[1]
 
     def shortestPathActions(self):
-
-        pawn_actions = QuoridorUtils.getPawnActions(self.red_position[0], self.red_position[1],
-                                                    self.blue_position[0], self.blue_position[1],
-                                                    self.v_walls, self.h_walls)
-        pawn_translations = {
-            # NORTH
-            0: (+0, +1),
-            # SO
-            1: (+0, -1),
-            # EA
-            2: (+1, +0),
-            # WE
-            3: (-1, +0),
-            # JN
-            4: (+0, +2),
-            # JS
-            5: (+0, -2),
-            # JE
-            6: (+2, +0),
-            # JW
-            7: (-2, +0),
-            # JNE
-            8: (+1, +1),
-            # JSW
-            9: (-1, -1),
-            # JNW
-            10: (-1, +1),
-            # JSE
-            11: (+1, -1),
-        }
-
-        action_dists = np.zeros(12, dtype=float)
-        for i, p in enumerate(pawn_actions):
-            if p == 1:
-                x = self.red_position[0] + pawn_translations[i][0]
-                y = self.red_position[1] + pawn_translations[i][1]
-                action_dists[i] = ((self.n ** 2 + 1) - self.paths_red[x][y]) / (self.n ** 2 + 1)
-        return action_dists
+        # Distance left after each valid pawn action, the first values fed to the network
+        return self.features()[2][0, :12].astype(float)
 
     def transformWalls(self, wall):
         res = np.zeros((self.n, self.n))
@@ -219,44 +364,30 @@ class QuoridorBoard:
         return res
 
     def getBoardHashable(self):
-        return (self.red_position, self.blue_position, self.red_walls, self.blue_walls, self.v_walls.tostring(),
-                self.h_walls.tostring(), self.draw)
+        # pawns, walls left and packed walls
+        origin = self.origin
+        return self.state[origin:origin + self.layout['key_size']].tobytes(), self.draw
+
+    def getBoardKey(self):
+        """
+        64-bit Zobrist key of the position, maintained by QuoridorUtils. It tells
+        apart the same positions as getBoardHashable, barring collisions.
+        """
+        key, = KEY_FORMAT.unpack_from(self.state, self.state.itemsize * (self.origin + QuoridorUtils.KEY))
+        return key ^ QuoridorUtils.ZOBRIST_DRAW if self.draw else key
 
     def setBoard(self, board):
-        self.history = copy.deepcopy(board.history)
-        self.v_walls = np.array(board.v_walls, copy=True)
-        self.h_walls = np.array(board.h_walls, copy=True)
+        self.history = board.history
+        self.state = board.state.copy()
         self.draw = board.draw
-        self.paths_red = np.array(board.paths_red, copy=True)
-        self.paths_blue = np.array(board.paths_blue, copy=True)
-        self.is_flipped = board.is_flipped
-
-        self.legal_vwalls = np.array(board.legal_vwalls, copy=True)
-        self.legal_hwalls = np.array(board.legal_hwalls, copy=True)
-
-        self.red_position = board.red_position
-        self.red_walls = board.red_walls
+        self.memo = None
+        self.perspective = board.perspective
         self.red_goal = board.red_goal
-
-        self.blue_position = board.blue_position
-        self.blue_walls = board.blue_walls
         self.blue_goal = board.blue_goal
 
     def flipBoard(self):
-        self.is_flipped = not self.is_flipped
-        self.red_position, self.blue_position = (self.n - 1 - self.blue_position[0],
-                                                 self.n - 1 - self.blue_position[1]), \
-                                                (self.n - 1 - self.red_position[0],
-                                                 self.n - 1 - self.red_position[1])
-        self.red_walls, self.blue_walls = self.blue_walls, self.red_walls
-        self.paths_blue, self.paths_red = self.paths_red, self.paths_blue
-
-        self.v_walls = np.flip(self.v_walls, (0, 1))
-        self.h_walls = np.flip(self.h_walls, (0, 1))
-        self.legal_vwalls = np.flip(self.legal_vwalls, (0, 1))
-        self.legal_hwalls = np.flip(self.legal_hwalls, (0, 1))
-        self.paths_red = np.flip(self.paths_red, (0, 1))
-        self.paths_blue = np.flip(self.paths_blue, (0, 1))
+        # Only the perspective changes, the state is shared with other views
+        self.perspective = -self.perspective
 
     def makeCanonical(self, player):
         if player != 1:
@@ -264,88 +395,68 @@ class QuoridorBoard:
         return self
 
     def getValidActions(self, player):
-        if player == 1:
-            pawn_actions = QuoridorUtils.getPawnActions(self.red_position[0], self.red_position[1],
-                                                        self.blue_position[0], self.blue_position[1],
-                                                        self.v_walls, self.h_walls)
-
-            # pawn_actions = 12 * [0]
-            if self.red_walls > 0:
-                wall_actions = list(np.concatenate((self.legal_vwalls.flatten(), self.legal_hwalls.flatten())))
-            else:
-                wall_actions = 2 * (self.n - 1) ** 2 * [0]
-        else:
-            pawn_actions = QuoridorUtils.getPawnActions(self.blue_position[0], self.blue_position[1],
-                                                        self.red_position[0], self.red_position[1],
-                                                        self.v_walls, self.h_walls)
-            if self.blue_walls > 0:
-                wall_actions = list(np.concatenate((self.legal_vwalls.flatten(), self.legal_hwalls.flatten())))
-            else:
-                wall_actions = 2 * (self.n - 1) ** 2 * [0]
-
-        actions = pawn_actions + wall_actions
-        if sum(actions) == 0:
-            self.plot(save=False)
-        return actions
+        """
+        Read-only uint8 mask of the valid actions of player, built once per
+        position.
+        """
+        memo = self.positionMemo()
+        valids = memo.valids.get(player)
+        if valids is None:
+            valids = (self.valid_red if player == 1 else self.valid_blue).astype(np.uint8)
+            valids.flags.writeable = False
+            memo.valids[player] = valids
+            if not valids.any():
+                self.plot(save=False)
+        return valids
+
+    def legalActions(self, player):
+        """
+        Read-only array of the indices of the valid actions of player, built
+        once per position.
+        """
+        memo = self.positionMemo()
+        legal = memo.legal.get(player)
+        if legal is None:
+            legal = np.flatnonzero(self.getValidActions(player))
+            legal.flags.writeable = False
+            memo.legal[player] = legal
+        return legal
 
     def executeAction(self, player, action):
         self.addToHistory()
-        pawn_moves = 12
-        vertical_wall_moves = pawn_moves + (self.n - 1) ** 2
-        if player == -1:
-            action = self.convert_action[action]
-
-        # Pawn Moves
-        if 0 <= action < pawn_moves:
-            x, y = self.red_position if player == 1 else self.blue_position
-            self.actions[action](player, x, y)
-        else:
-            # Vertical Walls
-            if pawn_moves <= action < vertical_wall_moves:
-                x = int((action - pawn_moves) / (self.n - 1))
-                y = int((action - pawn_moves) % (self.n - 1))
-                self.actions['vw'](player, x, y)
-            # Horizontal Walls
-            else:
-                x = int((action - vertical_wall_moves) / (self.n - 1))
-                y = int((action - vertical_wall_moves) % (self.n - 1))
-                self.actions['hw'](player, x, y)
-
-        self.paths_red, self.paths_blue = QuoridorUtils.getPathMatrices(self.v_walls, self.h_walls)
-
-        if self.red_walls > 0 or self.blue_walls > 0:
-            self.legal_vwalls, self.legal_hwalls = QuoridorUtils.updateWallActions(
-                self.red_position[0], self.red_position[1], self.n // 2, self.red_goal,
-                self.blue_position[0], self.blue_position[1], self.n // 2, self.blue_goal,
-                self.v_walls, self.h_walls)
-
-    def move(self, player, x, y, dx=0, dy=0):
-        if player == 1:
-            self.red_position = (x + dx, y + dy)
-        else:
-            self.blue_position = (x + dx, y + dy)
-
-    def placeVerticalWall(self, player, x, y):
-        if player == 1:
-            self.red_walls -= 1
-        else:
-            self.blue_walls -= 1
-
-        self.v_walls[x, y] = 1
-
-    def placeHorizontalWall(self, player, x, y):
-        if player == 1:
-            self.red_walls -= 1
-        else:
-            self.blue_walls -= 1
-
-        self.h_walls[x, y] = 1
+        # Actions of the player seen from the other side are converted by QuoridorUtils
+        QuoridorUtils.applyAction(self.state, self.n, player * self.perspective, action, self.incremental_walls)
+        if action >= 12:
+            # Walls stay on the board: no earlier position can be reached again
+            self.history = None
+
+    def doAction(self, player, action):
+        """
+        executeAction that undoAction reverts. The state is saved in a stack
+        kept by the board, so walking a search tree down and back up allocates
+        nothing once the stack is as deep as the tree. Views sharing the state
+        see the changes until they are undone.
+        """
+        depth = len(self.undo_info)
+        if self.undo_states is None or depth == len(self.undo_states):
+            undo_states = np.empty((max(16, 2 * depth), self.state.size), np.int16)
+            if depth:
+                undo_states[:depth] = self.undo_states
+            self.undo_states = undo_states
+        self.undo_states[depth] = self.state
+        self.undo_info.append((self.history, self.draw, self.perspective))
+        self.executeAction(player, action)
+
+    def undoAction(self):
+        self.history, self.draw, self.perspective = self.undo_info.pop()
+        self.state[:] = self.undo_states[len(self.undo_info)]
 
     def plot(self, path=None, name=None, save=True, print_lw=True, print_pm=False, save_folder=None):
         if path is None:
             path = []
         if name is None:
-            name = str(self.getBoardHashable())
+            # the hashable holds raw bytes, which may contain '/'
+            name = format(self.getBoardKey(), '016x')
 
         fig_map, ax_map = plt.subplots(1, 1)
 
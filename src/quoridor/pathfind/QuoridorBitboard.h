@@ -0,0 +1,617 @@
+#ifndef QUORIDOR_BITBOARD_H
+#define QUORIDOR_BITBOARD_H
+
+#include <algorithm>
+#include <cstdint>
+#include <cstdlib>
+#include <stdexcept>
+#include <type_traits>
+#include <vector>
+
+
+// Fixed width set of board cells. Cell (x, y) is stored at bit y * n + x, so a
+// step north is a shift by n and a step east is a shift by one.
+template<int W>
+struct Bits {
+    uint64_t w[W];
+
+    static inline Bits zero() {
+        Bits b;
+        for (int i = 0; i < W; ++i) b.w[i] = 0;
+        return b;
+    }
+
+    inline void set(int i) { w[i >> 6] |= uint64_t(1) << (i & 63); }
+
+    inline void reset(int i) { w[i >> 6] &= ~(uint64_t(1) << (i & 63)); }
+
+    inline bool test(int i) const { return (w[i >> 6] >> (i & 63)) & 1; }
+
+    inline bool any() const {
+        uint64_t r = 0;
+        for (int i = 0; i < W; ++i) r |= w[i];
+        return r != 0;
+    }
+
+    inline bool operator==(const Bits &o) const {
+        for (int i = 0; i < W; ++i)
+            if (w[i] != o.w[i]) return false;
+        return true;
+    }
+
+    inline bool operator!=(const Bits &o) const { return !(*this == o); }
+
+    inline Bits operator|(const Bits &o) const {
+        Bits r;
+        for (int i = 0; i < W; ++i) r.w[i] = w[i] | o.w[i];
+        return r;
+    }
+
+    inline Bits operator&(const Bits &o) const {
+        Bits r;
+        for (int i = 0; i < W; ++i) r.w[i] = w[i] & o.w[i];
+        return r;
+    }
+
+    inline Bits operator^(const Bits &o) const {
+        Bits r;
+        for (int i = 0; i < W; ++i) r.w[i] = w[i] ^ o.w[i];
+        return r;
+    }
+
+    // this & ~o
+    inline Bits andNot(const Bits &o) const {
+        Bits r;
+        for (int i = 0; i < W; ++i) r.w[i] = w[i] & ~o.w[i];
+        return r;
+    }
+
+    inline Bits &operator|=(const Bits &o) {
+        for (int i = 0; i < W; ++i) w[i] |= o.w[i];
+        return *this;
+    }
+
+    inline Bits &operator&=(const Bits &o) {
+        for (int i = 0; i < W; ++i) w[i] &= o.w[i];
+        return *this;
+    }
+
+    // Shifts towards higher bits, 0 <= k < 64
+    inline Bits operator<<(int k) const {
+        if (k == 0) return *this;
+        Bits r;
+        for (int i = W - 1; i > 0; --i) r.w[i] = (w[i] << k) | (w[i - 1] >> (64 - k));
+        r.w[0] = w[0] << k;
+        return r;
+    }
+
+    // Shifts towards lower bits, 0 <= k < 64
+    inline Bits operator>>(int k) const {
+        if (k == 0) return *this;
+        Bits r;
+        for (int i = 0; i < W - 1; ++i) r.w[i] = (w[i] >> k) | (w[i + 1] << (64 - k));
+        r.w[W - 1] = w[W - 1] >> k;
+        return r;
+    }
+
+    inline int count() const {
+        int c = 0;
+        for (int i = 0; i < W; ++i) c += __builtin_popcountll(w[i]);
+        return c;
+    }
+
+    // Calls f(index) for every bit set, in increasing order
+    template<typename F>
+    inline void forEach(F f) const {
+        for (int i = 0; i < W; ++i) {
+            uint64_t v = w[i];
+            while (v) {
+                f((i << 6) + __builtin_ctzll(v));
+                v &= v - 1;
+            }
+        }
+    }
+};
+
+
+// Masks that only depend on the board size. They are built once per n, the
+// first time a board of width W is used, and shared by every board of that
+// size, so boards and wall placements need no bounds checks.
+template<int W>
+struct BoardTables {
+    typedef Bits<W> B;
+
+    int n = 0;
+    B cells, slots;
+    // open edges of the empty board
+    B north_open, south_open, east_open, west_open;
+    // wall slots along each border
+    B first_col, last_col, first_row, last_row;
+    std::vector<B> rows;
+    // indexed by wall anchor: cells whose east (vertical wall) or north
+    // (horizontal wall) edge that wall blocks
+    std::vector<B> v_blocks, h_blocks;
+    // indexed by cell: wall slots blocking its east / north edge
+    std::vector<B> east_blockers, north_blockers;
+
+    BoardTables() = default;
+
+    explicit BoardTables(int board_size) : n(board_size), rows(n), v_blocks(n * n), h_blocks(n * n),
+                                           east_blockers(n * n), north_blockers(n * n) {
+        cells = slots = north_open = east_open = B::zero();
+        first_col = last_col = first_row = last_row = B::zero();
+        for (int y = 0; y < n; ++y) {
+            rows[y] = B::zero();
+            for (int x = 0; x < n; ++x) {
+                int i = y * n + x;
+                cells.set(i);
+                rows[y].set(i);
+                v_blocks[i] = h_blocks[i] = east_blockers[i] = north_blockers[i] = B::zero();
+                if (y < n - 1) north_open.set(i);
+                if (x < n - 1) east_open.set(i);
+                if (x < n - 1 && y < n - 1) {
+                    slots.set(i);
+                    if (x == 0) first_col.set(i);
+                    if (x == n - 2) last_col.set(i);
+                    if (y == 0) first_row.set(i);
+                    if (y == n - 2) last_row.set(i);
+                    v_blocks[i].set(i);
+                    v_blocks[i].set(i + n);
+                    h_blocks[i].set(i);
+                    h_blocks[i].set(i + 1);
+                }
+            }
+        }
+        south_open = north_open << n;
+        west_open = east_open << 1;
+        slots.forEach([&](int i) {
+            v_blocks[i].forEach([&](int c) { east_blockers[c].set(i); });
+            h_blocks[i].forEach([&](int c) { north_blockers[c].set(i); });
+        });
+    }
+
+    // Tables for every board size handled with W words, built on first use
+    static inline const BoardTables &get(int board_size) {
+        static const std::vector<BoardTables> tables = [] {
+            std::vector<BoardTables> t;
+            for (int size = 0; size * size <= 64 * W; ++size)
+                t.push_back(size >= 2 ? BoardTables(size) : BoardTables());
+            return t;
+        }();
+        return tables[board_size];
+    }
+};
+
+
+// Walls and open edges of a board as bitmasks. A wall is stored at the cell of
+// its south west corner: vertical wall (x, y) blocks the east side of cells
+// (x, y) and (x, y + 1), horizontal wall (x, y) blocks the north side of cells
+// (x, y) and (x + 1, y).
+template<int W>
+struct QuoridorBitboard {
+    typedef Bits<W> B;
+
+    const BoardTables<W> *tables;
+    int n;
+    B cells;
+    // valid wall anchors, x < n - 1 and y < n - 1
+    B slots;
+    B vwalls;
+    B hwalls;
+    // cells that can step in each direction
+    B north_open;
+    B south_open;
+    B east_open;
+    B west_open;
+
+    explicit QuoridorBitboard(int board_size) : tables(&BoardTables<W>::get(board_size)), n(board_size) {
+        cells = tables->cells;
+        slots = tables->slots;
+        vwalls = B::zero();
+        hwalls = B::zero();
+        north_open = tables->north_open;
+        south_open = tables->south_open;
+        east_open = tables->east_open;
+        west_open = tables->west_open;
+    }
+
+    // v and h are (n - 1) x (n - 1) wall arrays indexed [x * (n - 1) + y]
+    QuoridorBitboard(int board_size, const int16_t *v, const int16_t *h) : QuoridorBitboard(board_size) {
+        for (int x = 0; x < n - 1; ++x) {
+            for (int y = 0; y < n - 1; ++y) {
+                if (v[x * (n - 1) + y] == 1) placeVerticalWall(x, y);
+                if (h[x * (n - 1) + y] == 1) placeHorizontalWall(x, y);
+            }
+        }
+    }
+
+    inline int index(int x, int y) const { return y * n + x; }
+
+    inline bool inside(int x, int y) const { return x >= 0 && y >= 0 && x < n && y < n; }
+
+    inline void placeVerticalWall(int x, int y) {
+        int i = index(x, y);
+        const B &blocks = tables->v_blocks[i];
+        vwalls.set(i);
+        east_open = east_open.andNot(blocks);
+        west_open = west_open.andNot(blocks << 1);
+    }
+
+    inline void placeHorizontalWall(int x, int y) {
+        int i = index(x, y);
+        const B &blocks = tables->h_blocks[i];
+        hwalls.set(i);
+        north_open = north_open.andNot(blocks);
+        south_open = south_open.andNot(blocks << n);
+    }
+
+    // Same meaning as hasHWN / hasVWE: true when the north / east side of
+    // (x, y) is blocked by a wall or by the border
+    inline bool blockedNorth(int x, int y) const { return !inside(x, y) || !north_open.test(index(x, y)); }
+
+    inline bool blockedEast(int x, int y) const { return !inside(x, y) || !east_open.test(index(x, y)); }
+
+    inline const B &row(int y) const { return tables->rows[y]; }
+
+    // All cells one step away from the frontier
+    inline B step(const B &f) const {
+        return (((f & north_open) << n) | ((f & south_open) >> n)) |
+               (((f & east_open) << 1) | ((f & west_open) >> 1));
+    }
+
+    inline bool canReachRow(int x, int y, int goal_y) const {
+        const B &goal = row(goal_y);
+        B reached = B::zero();
+        reached.set(index(x, y));
+        while (!(reached & goal).any()) {
+            B next = reached | step(reached);
+            if (next == reached) return false;
+            reached = next;
+        }
+        return true;
+    }
+
+    // Breadth first distances from the goal row, one frontier per layer.
+    // Unreachable cells keep n * n + 1. Output is indexed [x * n + y].
+    inline void distances(int goal_y, int16_t *path) const {
+        int max = n * n + 1;
+        for (int i = 0; i < n * n; ++i) path[i] = max;
+
+        B frontier = row(goal_y);
+        B visited = frontier;
+        int d = 0;
+        while (frontier.any()) {
+            frontier.forEach([&](int i) { path[(i % n) * n + i / n] = d; });
+            frontier = step(frontier).andNot(visited);
+            visited |= frontier;
+            ++d;
+        }
+    }
+
+    template<typename F>
+    inline void forNeighbors(int x, int y, F f) const {
+        if (!blockedNorth(x, y)) f(x, y + 1);
+        if (!blockedNorth(x, y - 1)) f(x, y - 1);
+        if (!blockedEast(x, y)) f(x + 1, y);
+        if (!blockedEast(x - 1, y)) f(x - 1, y);
+    }
+
+    inline void repairDistances(int16_t *path, int wx, int wy, int goal_y, bool vertical) const;
+
+    inline bool shortestPath(int x, int y, int goal_y, B &north_edges, B &east_edges) const;
+
+    inline void pawnActions(int px, int py, int ox, int oy, int16_t *actions) const;
+
+    inline void freeWalls(B &free_v, B &free_h) const;
+
+    inline void closingWalls(B &closing_v, B &closing_h) const;
+
+    inline void pathWalls(int x, int y, int goal_y, B &path_v, B &path_h) const;
+
+    inline void routeWalls(int x0, int y0, int x1, int y1, int ox, int oy, B &route_v, B &route_h) const;
+
+    inline void cutWalls(int x, int y, int goal_y, const B &cand_v, const B &cand_h, B &cut_v, B &cut_h) const;
+
+    inline void wallActions(int px, int py, int pgy, int ox, int oy, int ogy, B &legal_v, B &legal_h) const;
+
+    inline void addCutWalls(int x, int y, int goal_y, B &cut_v, B &cut_h) const;
+
+    inline void moveCutWalls(int x0, int y0, int x1, int y1, int ox, int oy, int goal_y, B &cut_v, B &cut_h) const;
+};
+
+
+// Updates a distance map (indexed [x * n + y]) after wall (wx, wy) was placed
+// on this board. Distances can only grow, and only if one of the four cells
+// next to the wall lost its last neighbour one step closer to the goal (its
+// parent). Those cells are checked: if none lost its parent the map is kept as
+// is, otherwise it is rebuilt in full with the bitboard flood.
+template<int W>
+inline void QuoridorBitboard<W>::repairDistances(int16_t *path, int wx, int wy, int goal_y, bool vertical) const {
+    const int max = n * n + 1;
+    auto dist = [&](int x, int y) { return path[x * n + y]; };
+    auto orphaned = [&](int x, int y) {
+        if (dist(x, y) == max || dist(x, y) == 0) return false;
+        bool has_parent = false;
+        forNeighbors(x, y, [&](int px, int py) { if (dist(px, py) == dist(x, y) - 1) has_parent = true; });
+        return !has_parent;
+    };
+    bool stale;
+    if (vertical)
+        stale = orphaned(wx, wy) || orphaned(wx + 1, wy) || orphaned(wx, wy + 1) || orphaned(wx + 1, wy + 1);
+    else
+        stale = orphaned(wx, wy) || orphaned(wx, wy + 1) || orphaned(wx + 1, wy) || orphaned(wx + 1, wy + 1);
+    if (!stale) return;
+
+    distances(goal_y, path);
+}
+
+
+// Edges used by one shortest path from (x, y) to the goal row: north_edges holds
+// the cells left through their north side and east_edges the cells left through
+// their east side (steps south / west are stored on the cell they enter).
+// A wall that blocks none of these edges leaves that path intact.
+template<int W>
+inline bool QuoridorBitboard<W>::shortestPath(int x, int y, int goal_y, B &north_edges, B &east_edges) const {
+    B layers[W * 64];
+    const B &goal = row(goal_y);
+    B visited = B::zero();
+    visited.set(index(x, y));
+    layers[0] = visited;
+    int d = 0;
+    while (!(layers[d] & goal).any()) {
+        B next = step(layers[d]).andNot(visited);
+        if (!next.any()) {
+            // No path: every edge may matter
+            north_edges = cells;
+            east_edges = cells;
+            return false;
+        }
+        visited |= next;
+        layers[++d] = next;
+    }
+
+    north_edges = B::zero();
+    east_edges = B::zero();
+    int cur = -1;
+    (layers[d] & goal).forEach([&](int i) { if (cur < 0) cur = i; });
+    for (; d > 0; --d) {
+        const B &prev = layers[d - 1];
+        if (cur >= n && prev.test(cur - n) && north_open.test(cur - n)) {
+            cur -= n;
+            north_edges.set(cur);
+        } else if (cur + n < n * n && prev.test(cur + n) && north_open.test(cur)) {
+            north_edges.set(cur);
+            cur += n;
+        } else if (cur % n > 0 && prev.test(cur - 1) && east_open.test(cur - 1)) {
+            cur -= 1;
+            east_edges.set(cur);
+        } else {
+            east_edges.set(cur);
+            cur += 1;
+        }
+    }
+    return true;
+}
+
+
+template<int W>
+inline void QuoridorBitboard<W>::pawnActions(int player_x, int player_y, int opponent_x, int opponent_y,
+                                             int16_t *actions) const {
+    const int N = 0;
+    const int S = 1;
+    const int E = 2;
+    const int WE = 3;
+    const int JN = 4;
+    const int JS = 5;
+    const int JE = 6;
+    const int JW = 7;
+    const int NE = 8;
+    const int SW = 9;
+    const int NW = 10;
+    const int SE = 11;
+
+    //    NORTH
+    if (!blockedNorth(player_x, player_y)) {
+        if ((player_x != opponent_x) || (player_y + 1 != opponent_y)) {
+            actions[N] = 1;
+        } else if (!blockedNorth(player_x, player_y + 1)) {
+            actions[JN] = 1;
+        } else {
+            if (!blockedEast(player_x, player_y + 1)) actions[NE] = 1;
+            if (!blockedEast(player_x - 1, player_y + 1)) actions[NW] = 1;
+        }
+    }
+
+    //    SOUTH
+    if (!blockedNorth(player_x, player_y - 1)) {
+        if ((player_x != opponent_x) || (player_y - 1 != opponent_y)) {
+            actions[S] = 1;
+        } else if (!blockedNorth(player_x, player_y - 2)) {
+            actions[JS] = 1;
+        } else {
+            if (!blockedEast(player_x, player_y - 1)) actions[SE] = 1;
+            if (!blockedEast(player_x - 1, player_y - 1)) actions[SW] = 1;
+        }
+    }
+
+    //    EAST
+    if (!blockedEast(player_x, player_y)) {
+        if ((player_x + 1 != opponent_x) || (player_y != opponent_y)) {
+            actions[E] = 1;
+        } else if (!blockedEast(player_x + 1, player_y)) {
+            actions[JE] = 1;
+        } else {
+            if (!blockedNorth(player_x + 1, player_y)) actions[NE] = 1;
+            if (!blockedNorth(player_x + 1, player_y - 1)) actions[SE] = 1;
+        }
+    }
+
+    //    WEST
+    if (!blockedEast(player_x - 1, player_y)) {
+        if ((player_x - 1 != opponent_x) || (player_y != opponent_y)) {
+            actions[WE] = 1;
+        } else if (!blockedEast(player_x - 2, player_y)) {
+            actions[JW] = 1;
+        } else {
+            if (!blockedNorth(player_x - 1, player_y)) actions[NW] = 1;
+            if (!blockedNorth(player_x - 1, player_y - 1)) actions[SW] = 1;
+        }
+    }
+}
+
+
+// Slots not overlapping or crossing a placed wall
+template<int W>
+inline void QuoridorBitboard<W>::freeWalls(B &free_v, B &free_h) const {
+    free_v = slots.andNot(vwalls | (vwalls << n) | (vwalls >> n) | hwalls);
+    free_h = slots.andNot(hwalls | (hwalls << 1) | (hwalls >> 1) | vwalls);
+}
+
+
+// Slots touching other walls or the border in at least two of their three
+// connection points (both ends and the middle). Only these can close a region.
+template<int W>
+inline void QuoridorBitboard<W>::closingWalls(B &closing_v, B &closing_h) const {
+    const int n2 = 2 * n;
+    const B &first_col = tables->first_col;
+    const B &last_col = tables->last_col;
+    const B &first_row = tables->first_row;
+    const B &last_row = tables->last_row;
+
+    // Vertical walls: north end, south end and middle
+    B h_row = hwalls | (hwalls << 1) | (hwalls >> 1);
+    B v_north = last_row | (h_row >> n) | (vwalls >> n2);
+    B v_south = first_row | (h_row << n) | (vwalls << n2);
+    B v_middle = (hwalls << 1) | (hwalls >> 1);
+    closing_v = ((v_north & v_south) | (v_north & v_middle) | (v_south & v_middle)) & slots;
+
+    // Horizontal walls: east end, west end and middle
+    B v_col = vwalls | (vwalls << n) | (vwalls >> n);
+    B h_east = last_col | (v_col >> 1) | (hwalls.andNot(first_col | (first_col << 1)) >> 2);
+    B h_west = first_col | (v_col << 1) | (hwalls.andNot(last_col) << 2);
+    B h_middle = (vwalls << n) | (vwalls >> n);
+    closing_h = ((h_east & h_west) | (h_east & h_middle) | (h_west & h_middle)) & slots;
+}
+
+
+// Slots blocking an edge of one shortest path from (x, y) to the goal row.
+// Any other wall leaves that path intact.
+template<int W>
+inline void QuoridorBitboard<W>::pathWalls(int x, int y, int goal_y, B &path_v, B &path_h) const {
+    B north_edges, east_edges;
+    shortestPath(x, y, goal_y, north_edges, east_edges);
+    path_v = (east_edges | (east_edges >> n)) & slots;
+    path_h = (north_edges | (north_edges >> 1)) & slots;
+}
+
+
+// Slots blocking the edges a pawn crossed going from (x0, y0) to (x1, y1).
+// Jumps pass through the opponent cell (ox, oy).
+template<int W>
+inline void QuoridorBitboard<W>::routeWalls(int x0, int y0, int x1, int y1, int ox, int oy,
+                                            B &route_v, B &route_h) const {
+    route_v = B::zero();
+    route_h = B::zero();
+    auto block = [&](int ax, int ay, int bx, int by) {
+        if (ax == bx)
+            route_h |= tables->north_blockers[index(ax, std::min(ay, by))];
+        else
+            route_v |= tables->east_blockers[index(std::min(ax, bx), ay)];
+    };
+    if (std::abs(x1 - x0) + std::abs(y1 - y0) == 1) {
+        block(x0, y0, x1, y1);
+    } else {
+        block(x0, y0, ox, oy);
+        block(ox, oy, x1, y1);
+    }
+}
+
+
+// Re-evaluates the candidate slots of cut_v / cut_h: a bit is set when placing
+// that wall would disconnect (x, y) from the goal row.
+template<int W>
+inline void QuoridorBitboard<W>::cutWalls(int x, int y, int goal_y, const B &cand_v, const B &cand_h,
+                                          B &cut_v, B &cut_h) const {
+    cand_v.forEach([&](int i) {
+        QuoridorBitboard<W> test = *this;
+        test.placeVerticalWall(i % n, i / n);
+        if (test.canReachRow(x, y, goal_y))
+            cut_v.reset(i);
+        else
+            cut_v.set(i);
+    });
+    cand_h.forEach([&](int i) {
+        QuoridorBitboard<W> test = *this;
+        test.placeHorizontalWall(i % n, i / n);
+        if (test.canReachRow(x, y, goal_y))
+            cut_h.reset(i);
+        else
+            cut_h.set(i);
+    });
+}
+
+
+// Legal wall anchors for both orientations. A wall can only disconnect a pawn
+// if it closes a region and blocks an edge of that pawn's shortest path, so
+// only those candidates get a reachability check.
+template<int W>
+inline void QuoridorBitboard<W>::wallActions(int px, int py, int pgy, int ox, int oy, int ogy,
+                                             B &legal_v, B &legal_h) const {
+    B free_v, free_h, closing_v, closing_h, path_v, path_h;
+    freeWalls(free_v, free_h);
+    closingWalls(closing_v, closing_h);
+
+    B p_cut_v = B::zero(), p_cut_h = B::zero(), o_cut_v = B::zero(), o_cut_h = B::zero();
+    pathWalls(px, py, pgy, path_v, path_h);
+    cutWalls(px, py, pgy, free_v & closing_v & path_v, free_h & closing_h & path_h, p_cut_v, p_cut_h);
+    pathWalls(ox, oy, ogy, path_v, path_h);
+    cutWalls(ox, oy, ogy, free_v & closing_v & path_v, free_h & closing_h & path_h, o_cut_v, o_cut_h);
+
+    legal_v = free_v.andNot(p_cut_v | o_cut_v);
+    legal_h = free_h.andNot(p_cut_h | o_cut_h);
+}
+
+
+// Updates the cut walls of the pawn at (x, y) after a wall was placed. Walls
+// only remove edges, so previous cuts stay cuts and only the other candidates
+// on the new shortest path need a check.
+template<int W>
+inline void QuoridorBitboard<W>::addCutWalls(int x, int y, int goal_y, B &cut_v, B &cut_h) const {
+    B free_v, free_h, closing_v, closing_h, path_v, path_h;
+    freeWalls(free_v, free_h);
+    closingWalls(closing_v, closing_h);
+    pathWalls(x, y, goal_y, path_v, path_h);
+    cutWalls(x, y, goal_y,
+             (free_v & closing_v & path_v).andNot(cut_v), (free_h & closing_h & path_h).andNot(cut_h),
+             cut_v, cut_h);
+}
+
+
+// Updates the cut walls of a pawn that moved from (x0, y0) to (x1, y1). Both
+// cells stay connected under any wall that does not block the crossed edges,
+// so only walls blocking those edges can change status.
+template<int W>
+inline void QuoridorBitboard<W>::moveCutWalls(int x0, int y0, int x1, int y1, int ox, int oy, int goal_y,
+                                              B &cut_v, B &cut_h) const {
+    B free_v, free_h, closing_v, closing_h, route_v, route_h;
+    freeWalls(free_v, free_h);
+    closingWalls(closing_v, closing_h);
+    routeWalls(x0, y0, x1, y1, ox, oy, route_v, route_h);
+    cutWalls(x1, y1, goal_y, free_v & closing_v & route_v, free_h & closing_h & route_h, cut_v, cut_h);
+}
+
+
+// Calls f with a QuoridorBitboard tag wide enough for an n x n board
+template<typename F>
+inline auto withBitboard(int n, F &&f) {
+    if (n * n <= 64)
+        return f(std::integral_constant<int, 1>());
+    if (n * n <= 128)
+        return f(std::integral_constant<int, 2>());
+    if (n * n <= 256)
+        return f(std::integral_constant<int, 4>());
+    throw std::invalid_argument("QuoridorUtils supports boards up to 16x16");
+}
+
+
+#endif
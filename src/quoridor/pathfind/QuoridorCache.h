@@ -0,0 +1,148 @@
+#ifndef QUORIDOR_CACHE_H
+#define QUORIDOR_CACHE_H
+
+#include <algorithm>
+#include <cstdint>
+#include <cstring>
+#include <list>
+#include <mutex>
+#include <unordered_map>
+#include <utility>
+#include <vector>
+
+#include "QuoridorBitboard.h"
+
+
+// Compact signature of a wall configuration, optionally with both pawns
+struct WallKey {
+    uint64_t words[9];
+
+    inline bool operator==(const WallKey &o) const { return std::memcmp(words, o.words, sizeof(words)) == 0; }
+};
+
+struct WallKeyHash {
+    inline size_t operator()(const WallKey &key) const {
+        uint64_t h = 0x9e3779b97f4a7c15ULL;
+        for (uint64_t w : key.words) {
+            h ^= w + 0x9e3779b97f4a7c15ULL + (h << 6) + (h >> 2);
+            h *= 0xbf58476d1ce4e5b9ULL;
+        }
+        return (size_t) (h ^ (h >> 31));
+    }
+};
+
+// Key of an n x n board with vertical walls v and horizontal walls h. pawns
+// holds red x, y, blue x, y, or nullptr for a key on the walls only.
+template<int W>
+inline WallKey wallKey(int n, const Bits<W> &v, const Bits<W> &h, const int16_t *pawns) {
+    WallKey key;
+    std::memset(key.words, 0, sizeof(key.words));
+    key.words[0] = (uint64_t) n;
+    if (pawns) {
+        for (int i = 0; i < 4; ++i) key.words[0] |= (uint64_t) (uint16_t) pawns[i] << (16 * i + 8);
+    }
+    for (int i = 0; i < W; ++i) {
+        key.words[1 + i] = v.w[i];
+        key.words[5 + i] = h.w[i];
+    }
+    return key;
+}
+
+template<int W>
+inline WallKey wallKey(const QuoridorBitboard<W> &board, const int16_t *pawns) {
+    return wallKey(board.n, board.vwalls, board.hwalls, pawns);
+}
+
+
+// Least recently used cache of int16 arrays, bounded by a number of entries.
+// Safe to share between threads.
+class WallCache {
+public:
+    explicit WallCache(size_t capacity) : capacity(capacity) {}
+
+    // Copies count words of the cached value from offset (all of it by
+    // default) into out and returns true on a hit
+    inline bool get(const WallKey &key, int16_t *out, size_t offset = 0, size_t count = SIZE_MAX) {
+        std::lock_guard<std::mutex> lock(mutex);
+        auto it = index.find(key);
+        if (it == index.end()) {
+            ++misses;
+            return false;
+        }
+        ++hits;
+        entries.splice(entries.begin(), entries, it->second);
+        const std::vector<int16_t> &value = it->second->second;
+        std::copy_n(value.begin() + offset, std::min(count, value.size() - offset), out);
+        return true;
+    }
+
+    inline void put(const WallKey &key, const int16_t *value, size_t size) {
+        std::lock_guard<std::mutex> lock(mutex);
+        if (capacity == 0 || index.count(key)) return;
+        entries.emplace_front(key, std::vector<int16_t>(value, value + size));
+        index.emplace(key, entries.begin());
+        evict();
+    }
+
+    inline void setCapacity(size_t entries_budget) {
+        std::lock_guard<std::mutex> lock(mutex);
+        capacity = entries_budget;
+        evict();
+    }
+
+    inline void clear() {
+        std::lock_guard<std::mutex> lock(mutex);
+        entries.clear();
+        index.clear();
+        hits = misses = 0;
+    }
+
+    struct Stats {
+        size_t hits, misses, entries, capacity;
+    };
+
+    inline Stats stats() {
+        std::lock_guard<std::mutex> lock(mutex);
+        return {hits, misses, index.size(), capacity};
+    }
+
+private:
+    typedef std::list<std::pair<WallKey, std::vector<int16_t>>> Entries;
+
+    inline void evict() {
+        while (index.size() > capacity) {
+            index.erase(entries.back().first);
+            entries.pop_back();
+        }
+    }
+
+    std::mutex mutex;
+    size_t capacity;
+    size_t hits = 0;
+    size_t misses = 0;
+    // most recently used first
+    Entries entries;
+    std::unordered_map<WallKey, Entries::iterator, WallKeyHash> index;
+};
+
+// Distance maps of both players, keyed by the walls
+inline WallCache &pathCache() {
+    static WallCache cache(1 << 14);
+    return cache;
+}
+
+// Cut sets and legal walls, keyed by the walls and both pawns
+inline WallCache &wallCache() {
+    static WallCache cache(1 << 14);
+    return cache;
+}
+
+// Pawn race tables, keyed by the walls. Each holds 2 n^4 entries, so far fewer
+// are kept; setCacheCapacity sizes it with its own race_entries budget.
+inline WallCache &raceCache() {
+    static WallCache cache(64);
+    return cache;
+}
+
+
+#endif
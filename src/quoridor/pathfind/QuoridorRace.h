@@ -0,0 +1,105 @@
+#ifndef QUORIDOR_RACE_H
+#define QUORIDOR_RACE_H
+
+#include <cstdint>
+#include <vector>
+
+#include "QuoridorBitboard.h"
+#include "QuoridorCache.h"
+#include "QuoridorState.h"
+
+
+// Outcome of the pawn race left once both players are out of walls, for every
+// placement of the pawns and player to move: 1 if the player to move wins
+// with best play, -1 if it loses, 0 if neither can force a win. The entry of
+// red on cell r, blue on cell b (cells indexed y * n + x) is at
+// (turn * n * n + r) * n * n + b, turn 0 for red to move. The table is solved
+// by retrograde analysis from the finished races over the pawn moves of the
+// board, so jumps and blocking are exact. The repetition rule is ignored.
+template<int W>
+inline std::vector<int16_t> solveRace(const QuoridorBitboard<W> &board) {
+    int n = board.n, nn = n * n, size = 2 * nn * nn;
+    auto index = [nn](int turn, int red, int blue) { return (turn * nn + red) * nn + blue; };
+    std::vector<int16_t> result(size, 0);
+    std::vector<int> queue;
+    queue.reserve(size);
+
+    // Moves of every race in progress, stored as successors [first[s], first[s + 1])
+    std::vector<int> first(size + 1, 0), successors;
+    successors.reserve(4 * size);
+    int16_t moves[12];
+    for (int turn = 0; turn < 2; ++turn) {
+        for (int red = 0; red < nn; ++red) {
+            for (int blue = 0; blue < nn; ++blue) {
+                int s = index(turn, red, blue);
+                first[s] = (int) successors.size();
+                if (red == blue) continue;
+                bool red_home = red / n == n - 1, blue_home = blue / n == 0;
+                if (red_home || blue_home) {
+                    // Finished: the player to move won if it is the one at its goal
+                    result[s] = red_home == (turn == 0) ? 1 : -1;
+                    queue.push_back(s);
+                    continue;
+                }
+                int player = turn == 0 ? red : blue, opponent = turn == 0 ? blue : red;
+                std::fill_n(moves, 12, 0);
+                board.pawnActions(player % n, player / n, opponent % n, opponent / n, moves);
+                for (int a = 0; a < 12; ++a) {
+                    if (!moves[a]) continue;
+                    int cell = player + PAWN_DY[a] * n + PAWN_DX[a];
+                    successors.push_back(turn == 0 ? index(1, cell, blue) : index(0, red, cell));
+                }
+            }
+        }
+    }
+    first[size] = (int) successors.size();
+
+    // Predecessors, and the moves of each race not yet known to lose
+    std::vector<int> pred_first(size + 1, 0), predecessors(successors.size()), open_moves(size);
+    for (int t : successors) ++pred_first[t + 1];
+    for (int s = 0; s < size; ++s) pred_first[s + 1] += pred_first[s];
+    std::vector<int> fill(pred_first.begin(), pred_first.end() - 1);
+    for (int s = 0; s < size; ++s) {
+        open_moves[s] = first[s + 1] - first[s];
+        for (int i = first[s]; i < first[s + 1]; ++i) predecessors[fill[successors[i]]++] = s;
+    }
+
+    // A race is won if a move reaches a lost race, lost once every move reaches a won one
+    for (size_t head = 0; head < queue.size(); ++head) {
+        int s = queue[head];
+        for (int i = pred_first[s]; i < pred_first[s + 1]; ++i) {
+            int p = predecessors[i];
+            if (result[p] != 0) continue;
+            if (result[s] == -1) {
+                result[p] = 1;
+                queue.push_back(p);
+            } else if (--open_moves[p] == 0) {
+                result[p] = -1;
+                queue.push_back(p);
+            }
+        }
+    }
+    return result;
+}
+
+// Race outcome for the player to move in the block at s, the pawns and walls
+// of a state or of its mirror. Tables are solved once per wall configuration
+// and kept in the race cache.
+template<int W>
+inline int raceResult(const StateLayout &l, const int16_t *s, bool red_to_move) {
+    typedef StateLayout L;
+    int nn = l.n * l.n;
+    int index = ((red_to_move ? 0 : 1) * nn + s[L::RED_Y] * l.n + s[L::RED_X]) * nn +
+                s[L::BLUE_Y] * l.n + s[L::BLUE_X];
+    Bits<W> v, h;
+    loadWallMasks(s + l.walls, v, h);
+    WallKey key = wallKey(l.n, v, h, nullptr);
+    int16_t value;
+    if (raceCache().get(key, &value, index, 1)) return value;
+    std::vector<int16_t> table = solveRace(stateBoard<W>(l, s));
+    raceCache().put(key, table.data(), table.size());
+    return table[index];
+}
+
+
+#endif
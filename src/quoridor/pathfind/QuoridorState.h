@@ -0,0 +1,367 @@
+#ifndef QUORIDOR_STATE_H
+#define QUORIDOR_STATE_H
+
+#include <algorithm>
+#include <cstdint>
+#include <cstring>
+#include <stdexcept>
+
+#include "QuoridorBitboard.h"
+#include "QuoridorCache.h"
+
+
+// Layout of the int16 state buffer behind a QuoridorBoard. The header holds
+// the pawns, walls left and the 64-bit Zobrist key of the position (4 int16
+// words, native byte order), followed by the placed walls packed as bitboards;
+// together they identify the position. The mirror block that follows holds the
+// same fields for the board turned around, so that the other player's view
+// needs no copy. The rest is derived from them and kept up to date by
+// applyAction. Arrays are stored row-major with the same [x][y] indexing as
+// the Python side.
+struct StateLayout {
+    enum { RED_X, RED_Y, BLUE_X, BLUE_Y, RED_WALLS, BLUE_WALLS, KEY = 8, HEADER_SIZE = 12 };
+
+    int n, m, action_size;
+    // int16 words of a packed Bits<W> mask, indexed by y * n + x
+    int words;
+    // packed vertical then horizontal placed walls
+    int walls;
+    // int16 words identifying the position: header and walls
+    int key_size;
+    // header and walls of the board turned around
+    int mirror;
+    // (n, n) distances to the goal rows
+    int paths_red, paths_blue;
+    // packed vertical then horizontal walls disconnecting each pawn
+    int red_cuts, blue_cuts;
+    // (2, n - 1, n - 1) legal vertical / horizontal walls
+    int legal_walls;
+    // (action_size,) valid actions of each player, in board coordinates
+    int valid_red, valid_blue;
+    int size;
+
+    explicit StateLayout(int board_size) : n(board_size), m(board_size - 1), action_size(12 + 2 * m * m) {
+        words = withBitboard(n, [](auto w) { return (int) (sizeof(Bits<decltype(w)::value>) / sizeof(int16_t)); });
+        walls = HEADER_SIZE;
+        key_size = walls + 2 * words;
+        mirror = key_size;
+        paths_red = mirror + key_size;
+        paths_blue = paths_red + n * n;
+        red_cuts = paths_blue + n * n;
+        blue_cuts = red_cuts + 2 * words;
+        legal_walls = blue_cuts + 2 * words;
+        valid_red = legal_walls + 2 * m * m;
+        valid_blue = valid_red + action_size;
+        size = valid_blue + action_size;
+    }
+
+    // Action of the flipped board (player -1 view) in board coordinates. Pawn
+    // moves swap with their opposite, walls are rotated by 180 degrees.
+    inline int convertAction(int action) const {
+        if (action < 12) return action ^ 1;
+        int k = (action - 12) % (m * m);
+        return action - k + (m * m - 1 - k);
+    }
+};
+
+// Features hashed into the Zobrist key of a position
+enum ZobristFeature { Z_RED_PAWN, Z_BLUE_PAWN, Z_RED_WALLS, Z_BLUE_WALLS, Z_V_WALL, Z_H_WALL, Z_DRAW };
+
+// Pseudo random key of a feature at an index (cell, wall slot or count), the
+// splitmix64 finalizer of the three packed together
+inline uint64_t zobrist(int n, int feature, int index) {
+    uint64_t z = ((uint64_t) n << 40 | (uint64_t) feature << 20 | (uint64_t) (uint16_t) index) + 0x9e3779b97f4a7c15ULL;
+    z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+    z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+    return z ^ (z >> 31);
+}
+
+inline uint64_t loadKey(const int16_t *s) {
+    uint64_t key;
+    std::memcpy(&key, s + StateLayout::KEY, sizeof(key));
+    return key;
+}
+
+inline void storeKey(int16_t *s, uint64_t key) { std::memcpy(s + StateLayout::KEY, &key, sizeof(key)); }
+
+// Pawn steps in action order: N, S, E, W, JN, JS, JE, JW, JNE, JSW, JNW, JSE
+const int PAWN_DX[12] = {0, 0, 1, -1, 0, 0, 2, -2, 1, -1, -1, 1};
+const int PAWN_DY[12] = {1, -1, 0, 0, 2, -2, 0, 0, 1, -1, 1, -1};
+
+
+// Writes a wall set into an (n - 1, n - 1) buffer indexed [x][y]
+template<int W>
+inline void writeWalls(const QuoridorBitboard<W> &board, const Bits<W> &bits, int16_t *walls) {
+    int n = board.n;
+    std::fill_n(walls, (n - 1) * (n - 1), 0);
+    bits.forEach([&](int i) { walls[(i % n) * (n - 1) + i / n] = 1; });
+}
+
+// Reads a vertical and a horizontal mask packed at data
+template<int W>
+inline void loadWallMasks(const int16_t *data, Bits<W> &v, Bits<W> &h) {
+    std::memcpy(v.w, data, sizeof(v.w));
+    std::memcpy(h.w, data + sizeof(v.w) / sizeof(int16_t), sizeof(h.w));
+}
+
+template<int W>
+inline void storeWallMasks(const Bits<W> &v, const Bits<W> &h, int16_t *data) {
+    std::memcpy(data, v.w, sizeof(v.w));
+    std::memcpy(data + sizeof(v.w) / sizeof(int16_t), h.w, sizeof(h.w));
+}
+
+// Rotates a wall mask by 180 degrees: (x, y) goes to (n - 2 - x, n - 2 - y)
+template<int W>
+inline Bits<W> rotateWalls(int n, const Bits<W> &bits) {
+    Bits<W> rotated = Bits<W>::zero();
+    int last = (n - 2) * (n + 1);
+    bits.forEach([&](int i) { rotated.set(last - i); });
+    return rotated;
+}
+
+
+template<int W>
+inline QuoridorBitboard<W> stateBoard(const StateLayout &l, const int16_t *s) {
+    QuoridorBitboard<W> board(l.n);
+    Bits<W> v, h;
+    loadWallMasks(s + l.walls, v, h);
+    v.forEach([&](int i) { board.placeVerticalWall(i % l.n, i / l.n); });
+    h.forEach([&](int i) { board.placeHorizontalWall(i % l.n, i / l.n); });
+    return board;
+}
+
+// Zobrist key of the pawns, walls left and placed walls
+template<int W>
+inline uint64_t positionKey(const StateLayout &l, const int16_t *s) {
+    typedef StateLayout L;
+    int n = l.n;
+    uint64_t key = zobrist(n, Z_RED_PAWN, s[L::RED_Y] * n + s[L::RED_X]) ^
+                   zobrist(n, Z_BLUE_PAWN, s[L::BLUE_Y] * n + s[L::BLUE_X]) ^
+                   zobrist(n, Z_RED_WALLS, s[L::RED_WALLS]) ^ zobrist(n, Z_BLUE_WALLS, s[L::BLUE_WALLS]);
+    Bits<W> v, h;
+    loadWallMasks(s + l.walls, v, h);
+    v.forEach([&](int i) { key ^= zobrist(n, Z_V_WALL, i); });
+    h.forEach([&](int i) { key ^= zobrist(n, Z_H_WALL, i); });
+    return key;
+}
+
+// Flips a feature in the Zobrist keys of the state and of its mirror, where
+// colors swap and cells and wall slots are rotated by 180 degrees
+inline void toggleFeature(const StateLayout &l, int16_t *s, int feature, int index) {
+    int n = l.n, mirror_feature = feature, mirror_index = index;
+    if (feature == Z_RED_PAWN || feature == Z_BLUE_PAWN) {
+        mirror_feature = feature ^ 1;
+        mirror_index = n * n - 1 - index;
+    } else if (feature == Z_RED_WALLS || feature == Z_BLUE_WALLS) {
+        mirror_feature = feature ^ 1;
+    } else {
+        mirror_index = (n - 2) * (n + 1) - index;
+    }
+    storeKey(s, loadKey(s) ^ zobrist(n, feature, index));
+    storeKey(s + l.mirror, loadKey(s + l.mirror) ^ zobrist(n, mirror_feature, mirror_index));
+}
+
+// Pawns and walls left of the mirror block
+inline void writeMirrorHeader(const StateLayout &l, int16_t *s) {
+    typedef StateLayout L;
+    int16_t *r = s + l.mirror;
+    r[L::RED_X] = l.n - 1 - s[L::BLUE_X];
+    r[L::RED_Y] = l.n - 1 - s[L::BLUE_Y];
+    r[L::BLUE_X] = l.n - 1 - s[L::RED_X];
+    r[L::BLUE_Y] = l.n - 1 - s[L::RED_Y];
+    r[L::RED_WALLS] = s[L::BLUE_WALLS];
+    r[L::BLUE_WALLS] = s[L::RED_WALLS];
+}
+
+// Valid actions of both players from the pawns, walls left and legal walls
+template<int W>
+inline void writeValidActions(const StateLayout &l, const QuoridorBitboard<W> &board, int16_t *s) {
+    typedef StateLayout L;
+    for (int red = 1; red >= 0; --red) {
+        int16_t *valid = s + (red ? l.valid_red : l.valid_blue);
+        const int16_t *player = s + (red ? L::RED_X : L::BLUE_X);
+        const int16_t *opponent = s + (red ? L::BLUE_X : L::RED_X);
+        std::fill_n(valid, l.action_size, 0);
+        board.pawnActions(player[0], player[1], opponent[0], opponent[1], valid);
+        if (s[red ? L::RED_WALLS : L::BLUE_WALLS] > 0)
+            std::copy(s + l.legal_walls, s + l.legal_walls + 2 * l.m * l.m, valid + 12);
+    }
+}
+
+// Recomputes every derived field from the pawns and placed walls
+template<int W>
+inline void refreshState(const StateLayout &l, int16_t *s) {
+    typedef StateLayout L;
+    typedef Bits<W> B;
+    B v, h;
+    loadWallMasks(s + l.walls, v, h);
+    storeWallMasks(rotateWalls(l.n, v), rotateWalls(l.n, h), s + l.mirror + l.walls);
+    writeMirrorHeader(l, s);
+    storeKey(s, positionKey<W>(l, s));
+    storeKey(s + l.mirror, positionKey<W>(l, s + l.mirror));
+    auto board = stateBoard<W>(l, s);
+    board.distances(l.n - 1, s + l.paths_red);
+    board.distances(0, s + l.paths_blue);
+
+    B red_v = B::zero(), red_h = B::zero(), blue_v = B::zero(), blue_h = B::zero();
+    board.addCutWalls(s[L::RED_X], s[L::RED_Y], l.n - 1, red_v, red_h);
+    board.addCutWalls(s[L::BLUE_X], s[L::BLUE_Y], 0, blue_v, blue_h);
+    storeWallMasks(red_v, red_h, s + l.red_cuts);
+    storeWallMasks(blue_v, blue_h, s + l.blue_cuts);
+
+    B free_v, free_h;
+    board.freeWalls(free_v, free_h);
+    writeWalls(board, free_v.andNot(red_v | blue_v), s + l.legal_walls);
+    writeWalls(board, free_h.andNot(red_h | blue_h), s + l.legal_walls + l.m * l.m);
+    writeValidActions(l, board, s);
+}
+
+// Applies an action of player (1 or -1, whose actions are given in the
+// flipped view) and updates the derived fields. Pawn moves keep the distance
+// maps; legal walls follow the cut sets incrementally unless incremental is
+// false, in which case both are recomputed from scratch. The mirror block and
+// the Zobrist keys are updated with the features that changed. After a wall
+// placement, distance maps and cut sets are looked up in the wall caches
+// first, as many positions are reached by placing the same walls in a
+// different order.
+template<int W>
+inline void applyAction(const StateLayout &l, int16_t *s, int player, int action, bool incremental) {
+    typedef StateLayout L;
+    typedef Bits<W> B;
+    if (player == -1) action = l.convertAction(action);
+
+    int moved = 0, prev_x = -1, prev_y = -1, x = 0, y = 0, n = l.n;
+    bool vertical = false;
+    if (action < 12) {
+        int16_t *position = s + (player == 1 ? L::RED_X : L::BLUE_X);
+        int feature = player == 1 ? Z_RED_PAWN : Z_BLUE_PAWN;
+        prev_x = position[0];
+        prev_y = position[1];
+        position[0] += PAWN_DX[action];
+        position[1] += PAWN_DY[action];
+        toggleFeature(l, s, feature, prev_y * n + prev_x);
+        toggleFeature(l, s, feature, position[1] * n + position[0]);
+        moved = player;
+    } else {
+        vertical = action < 12 + l.m * l.m;
+        int k = (action - 12) % (l.m * l.m);
+        x = k / l.m;
+        y = k % l.m;
+        int16_t &walls_left = s[player == 1 ? L::RED_WALLS : L::BLUE_WALLS];
+        int feature = player == 1 ? Z_RED_WALLS : Z_BLUE_WALLS;
+        toggleFeature(l, s, feature, walls_left);
+        toggleFeature(l, s, feature, walls_left - 1);
+        walls_left -= 1;
+        B v, h;
+        loadWallMasks(s + l.walls, v, h);
+        (vertical ? v : h).set(y * n + x);
+        storeWallMasks(v, h, s + l.walls);
+        loadWallMasks(s + l.mirror + l.walls, v, h);
+        (vertical ? v : h).set((n - 2) * (n + 1) - (y * n + x));
+        storeWallMasks(v, h, s + l.mirror + l.walls);
+        toggleFeature(l, s, vertical ? Z_V_WALL : Z_H_WALL, y * n + x);
+    }
+    writeMirrorHeader(l, s);
+
+    auto board = stateBoard<W>(l, s);
+    if (!moved) {
+        // paths_red and paths_blue are contiguous
+        WallKey key = wallKey(board, nullptr);
+        if (!pathCache().get(key, s + l.paths_red)) {
+            board.repairDistances(s + l.paths_red, x, y, l.n - 1, vertical);
+            board.repairDistances(s + l.paths_blue, x, y, 0, vertical);
+            pathCache().put(key, s + l.paths_red, 2 * l.n * l.n);
+        }
+    }
+
+    if (s[L::RED_WALLS] > 0 || s[L::BLUE_WALLS] > 0) {
+        int rx = s[L::RED_X], ry = s[L::RED_Y], bx = s[L::BLUE_X], by = s[L::BLUE_Y];
+        // red_cuts, blue_cuts and legal_walls are contiguous; the header starts with the pawns
+        WallKey key;
+        if (!incremental) {
+            // The cut sets are recomputed too, a later incremental call starts from them
+            B red_v = B::zero(), red_h = B::zero(), blue_v = B::zero(), blue_h = B::zero();
+            board.addCutWalls(rx, ry, l.n - 1, red_v, red_h);
+            board.addCutWalls(bx, by, 0, blue_v, blue_h);
+            storeWallMasks(red_v, red_h, s + l.red_cuts);
+            storeWallMasks(blue_v, blue_h, s + l.blue_cuts);
+
+            B legal_v, legal_h;
+            board.wallActions(rx, ry, l.n - 1, bx, by, 0, legal_v, legal_h);
+            writeWalls(board, legal_v, s + l.legal_walls);
+            writeWalls(board, legal_h, s + l.legal_walls + l.m * l.m);
+        } else if (moved || !wallCache().get(key = wallKey(board, s + L::RED_X), s + l.red_cuts)) {
+            B red_v, red_h, blue_v, blue_h;
+            loadWallMasks(s + l.red_cuts, red_v, red_h);
+            loadWallMasks(s + l.blue_cuts, blue_v, blue_h);
+            if (moved == 1) {
+                board.moveCutWalls(prev_x, prev_y, rx, ry, bx, by, l.n - 1, red_v, red_h);
+            } else if (moved == -1) {
+                board.moveCutWalls(prev_x, prev_y, bx, by, rx, ry, 0, blue_v, blue_h);
+            } else {
+                board.addCutWalls(rx, ry, l.n - 1, red_v, red_h);
+                board.addCutWalls(bx, by, 0, blue_v, blue_h);
+            }
+            storeWallMasks(red_v, red_h, s + l.red_cuts);
+            storeWallMasks(blue_v, blue_h, s + l.blue_cuts);
+
+            B free_v, free_h;
+            board.freeWalls(free_v, free_h);
+            writeWalls(board, free_v.andNot(red_v | blue_v), s + l.legal_walls);
+            writeWalls(board, free_h.andNot(red_h | blue_h), s + l.legal_walls + l.m * l.m);
+            if (!moved) wallCache().put(key, s + l.red_cuts, 4 * l.words + 2 * l.m * l.m);
+        }
+    }
+    writeValidActions(l, board, s);
+}
+
+// Network input of a state seen by player perspective (1 or -1), as float32:
+// (2, n, n) pawn planes, (2, n - 1, n - 1) placed walls and 17 values (distance
+// left after each pawn action, walls left, distances of both pawns, draw), see
+// QuoridorBoard.getBoard. With mirrored, the same features for the board
+// mirrored along x, as getBoardFlippedHorizontally, which reads the distances
+// of the pawns at their mirrored cell.
+template<int W>
+inline void encodeState(const StateLayout &l, const int16_t *s, int perspective, bool draw, bool mirrored,
+                        float *planes, float *walls, float *values) {
+    typedef StateLayout L;
+    int n = l.n, m = l.m, nn = n * n;
+    // Header and walls are read from the block of the perspective, distances
+    // and valid actions from the other color rotated by 180 degrees
+    const int16_t *h = s + (perspective == 1 ? 0 : l.mirror);
+    auto path = [&](bool red, int x, int y) -> int {
+        if (perspective == 1) return s[(red ? l.paths_red : l.paths_blue) + x * n + y];
+        return s[(red ? l.paths_blue : l.paths_red) + (n - 1 - x) * n + (n - 1 - y)];
+    };
+    auto valid = [&](int action) -> bool {
+        return perspective == 1 ? s[l.valid_red + action] == 1 : s[l.valid_blue + l.convertAction(action)] == 1;
+    };
+    auto mirrorX = [&](int x, int size) { return mirrored ? size - 1 - x : x; };
+
+    std::fill_n(planes, 2 * nn, 0.0f);
+    planes[mirrorX(h[L::RED_X], n) * n + h[L::RED_Y]] = 1.0f;
+    planes[nn + mirrorX(h[L::BLUE_X], n) * n + h[L::BLUE_Y]] = 1.0f;
+
+    std::fill_n(walls, 2 * m * m, 0.0f);
+    Bits<W> v, hw;
+    loadWallMasks(h + l.walls, v, hw);
+    v.forEach([&](int i) { walls[mirrorX(i % n, m) * m + i / n] = 1.0f; });
+    hw.forEach([&](int i) { walls[m * m + mirrorX(i % n, m) * m + i / n] = 1.0f; });
+
+    // Values are computed in double as on the Python side, then rounded
+    static const int PAWN_MIRROR[12] = {0, 1, 3, 2, 4, 5, 7, 6, 10, 9, 8, 11};
+    double scale = nn + 1;
+    int red_x = h[L::RED_X], red_y = h[L::RED_Y], blue_x = h[L::BLUE_X], blue_y = h[L::BLUE_Y];
+    for (int i = 0; i < 12; ++i) {
+        int a = mirrored ? PAWN_MIRROR[i] : i;
+        values[i] = valid(a) ? (float) ((scale - path(true, red_x + PAWN_DX[a], red_y + PAWN_DY[a])) / scale) : 0.0f;
+    }
+    double max_walls = (n + 1) * (n + 1) / 10;
+    values[12] = (float) (h[L::RED_WALLS] / max_walls);
+    values[13] = (float) (h[L::BLUE_WALLS] / max_walls);
+    values[14] = (float) ((scale - path(true, mirrorX(red_x, n), red_y)) / scale);
+    values[15] = (float) ((scale - path(false, mirrorX(blue_x, n), blue_y)) / scale);
+    values[16] = draw ? 1.0f : 0.0f;
+}
+
+#endif
@@ -1,14 +1,22 @@
 #include <iostream>
+#include <optional>
+#include <string>
+#include <thread>
 #include <vector>
-#include <queue>
 #include <tuple>
 #include <stdio.h>
 #include <math.h>
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
+#include <pybind11/numpy.h>
 
 #include "QuoridorMapSearchNode.h"
 #include "QuoridorMapInfo.h"
+#include "QuoridorBitboard.h"
+#include "QuoridorState.h"
+#include "QuoridorRace.h"
+
+namespace py = pybind11;
 
 void printBoard(const std::vector<std::vector<int>> &board) {
     for (const auto &line : board) {
@@ -21,135 +29,64 @@ void printBoard(const std::vector<std::vector<int>> &board) {
 
 }
 
-//// If is blocked North of player
-//inline bool hasHWN(const std::vector<std::vector<int>> &hwalls, int x, int y, int board_size) {
-//    return (y >= board_size) || (y<0) || (x < board_size && hwalls[x][y] == 1) || (x > 0 && hwalls[x-1][y] == 1);
-//}
-//
-//// If is blocked East of player
-//inline bool hasVWE(const std::vector<std::vector<int>> &vwalls, int x, int y, int board_size) {
-//    return (x >= board_size) || (x<0) || (y < board_size && vwalls[x][y] == 1) || (y > 0 && vwalls[x][y-1] == 1);
-//}
-
-inline void setPawnActions(int player_x, int player_y, int opponent_x, int opponent_y,
-                           const std::vector<std::vector<int>> &vwalls, const std::vector<std::vector<int>> &hwalls,
-                           std::vector<int> &actions) {
-    const int N = 0;
-    const int S = 1;
-    const int E = 2;
-    const int W = 3;
-    const int JN = 4;
-    const int JS = 5;
-    const int JE = 6;
-    const int JW = 7;
-    const int NE = 8;
-    const int SW = 9;
-    const int NW = 10;
-    const int SE = 11;
-
-    int board_size = (int) vwalls.size();
-    //    NORTH
-    // If nothing blocks north
-    if (!hasHWN(hwalls, player_x, player_y)) {
-        // If no player on north
-        if ((player_x != opponent_x) || (player_y + 1 != opponent_y)) {
-            actions[N] = 1;
-        } else {
-            // If nothing blocking jump north
-            if (!hasHWN(hwalls, player_x, player_y + 1)) {
-                actions[JN] = 1;
-            } else {
-                // If nothing blocking north east
-                if (!hasVWE(vwalls, player_x, player_y + 1)) {
-                    actions[NE] = 1;
-                }
-                // If nothing blocking north west
-                if (!hasVWE(vwalls, player_x - 1, player_y + 1)) {
-                    actions[NW] = 1;
-                }
-            }
-
-        }
-    }
-
-    //    SOUTH
-    // If nothing blocks south
-    if (!hasHWN(hwalls, player_x, player_y - 1)) {
-        // If no player on south
-        if ((player_x != opponent_x) || (player_y - 1 != opponent_y)) {
-            actions[S] = 1;
-        } else {
-            // If nothing blocking jump south
-            if (!hasHWN(hwalls, player_x, player_y - 2)) {
-                actions[JS] = 1;
-            } else {
-                // If nothing blocking south east
-                if (!hasVWE(vwalls, player_x, player_y - 1)) {
-                    actions[SE] = 1;
-                }
-                // If nothing blocking south west
-                if (!hasVWE(vwalls, player_x - 1, player_y - 1)) {
-                    actions[SW] = 1;
-                }
-            }
-
-        }
-    }
+// Inputs accept any array-like and are converted to int16 only when needed.
+// Buffers are written in place, so they must already be C-contiguous int16
+// arrays; they are bound with noconvert() to reject anything else.
+// Arrays are allocated and checked while holding the GIL; the computations
+// themselves release it, so callers can run them on several threads.
+typedef py::array_t<int16_t, py::array::c_style | py::array::forcecast> WallArray;
+typedef py::array_t<int16_t, py::array::c_style> Buffer;
+typedef std::optional<Buffer> OptionalBuffer;
+typedef py::array_t<float, py::array::c_style> FloatBuffer;
+
+inline void checkShape(const py::array &array, std::initializer_list<py::ssize_t> shape, const char *name) {
+    if (array.ndim() != (py::ssize_t) shape.size() ||
+        !std::equal(shape.begin(), shape.end(), array.shape()))
+        throw std::invalid_argument(std::string("QuoridorUtils: unexpected shape for ") + name);
+}
 
-    //    EAST
-    // If nothing blocks east
-    if (!hasVWE(vwalls, player_x, player_y)) {
-        // If no player on east
-        if ((player_x + 1 != opponent_x) || (player_y != opponent_y)) {
-            actions[E] = 1;
-        } else {
-            // If nothing blocking jump east
-            if (!hasVWE(vwalls, player_x + 1, player_y)) {
-                actions[JE] = 1;
-            } else {
-                // If nothing blocking north east
-                if (!hasHWN(hwalls, player_x + 1, player_y)) {
-                    actions[NE] = 1;
-                }
-                // If nothing blocking south east
-                if (!hasHWN(hwalls, player_x + 1, player_y - 1)) {
-                    actions[SE] = 1;
-                }
-            }
+// Board size from a pair of (n - 1, n - 1) wall arrays
+inline int boardSize(const WallArray &vwalls, const WallArray &hwalls) {
+    int m = vwalls.ndim() == 2 ? (int) vwalls.shape(0) : -1;
+    checkShape(vwalls, {m, m}, "vwalls");
+    checkShape(hwalls, {m, m}, "hwalls");
+    return m + 1;
+}
 
-        }
-    }
+// Returns out cleared, or a new zeroed buffer when out is None
+inline Buffer outputBuffer(OptionalBuffer &out, std::initializer_list<py::ssize_t> shape, const char *name) {
+    Buffer buffer = out ? *out : Buffer(std::vector<py::ssize_t>(shape));
+    checkShape(buffer, shape, name);
+    std::fill_n(buffer.mutable_data(), buffer.size(), 0);
+    return buffer;
+}
 
-    //    WEST
-    // If nothing blocks west
-    if (!hasVWE(vwalls, player_x - 1, player_y)) {
-        // If no player on west
-        if ((player_x - 1 != opponent_x) || (player_y != opponent_y)) {
-            actions[W] = 1;
-        } else {
-            // If nothing blocking jump west
-            if (!hasVWE(vwalls, player_x - 2, player_y)) {
-                actions[JW] = 1;
-            } else {
-                // If nothing blocking north west
-                if (!hasHWN(hwalls, player_x - 1, player_y)) {
-                    actions[NW] = 1;
-                }
-                // If nothing blocking south west
-                if (!hasHWN(hwalls, player_x - 1, player_y - 1)) {
-                    actions[SW] = 1;
-                }
-            }
+template<int W>
+inline QuoridorBitboard<W> makeBoard(int board_size, const WallArray &vwalls, const WallArray &hwalls) {
+    return QuoridorBitboard<W>(board_size, vwalls.data(), hwalls.data());
+}
 
-        }
-    }
+inline std::vector<std::vector<int>> wallVector(const WallArray &walls) {
+    auto r = walls.unchecked<2>();
+    std::vector<std::vector<int>> v(r.shape(0), std::vector<int>(r.shape(1)));
+    for (py::ssize_t x = 0; x < r.shape(0); ++x)
+        for (py::ssize_t y = 0; y < r.shape(1); ++y)
+            v[x][y] = r(x, y);
+    return v;
 }
 
-inline std::vector<int> getPawnActions(int player_x, int player_y, int opponent_x, int opponent_y,
-                                       const std::vector<std::vector<int>> &vwalls,
-                                       const std::vector<std::vector<int>> &hwalls) {
-    std::vector<int> actions(12, 0);
-    setPawnActions(player_x, player_y, opponent_x, opponent_y, vwalls, hwalls, actions);
+inline Buffer getPawnActions(int player_x, int player_y, int opponent_x, int opponent_y,
+                             const WallArray &vwalls, const WallArray &hwalls, OptionalBuffer out) {
+    int board_size = boardSize(vwalls, hwalls);
+    Buffer actions = outputBuffer(out, {12}, "out");
+    int16_t *data = actions.mutable_data();
+    {
+        py::gil_scoped_release release;
+        withBitboard(board_size, [&](auto w) {
+            auto board = makeBoard<decltype(w)::value>(board_size, vwalls, hwalls);
+            board.pawnActions(player_x, player_y, opponent_x, opponent_y, data);
+        });
+    }
     return actions;
 }
 
@@ -158,56 +95,23 @@ inline bool pathExists(
         int start_y,
         int end_x,
         int end_y,
-        const std::vector<std::vector<int>> &vwalls,
-        const std::vector<std::vector<int>> &hwalls) {
-
-    // std::cout << "STL A* Search implementation\n(C)2001 Justin Heyes-Jones\n";
-
-    // Our sample problem defines the world as a 2d array representing a terrain
-    // Each element contains an integer from 0 to 5 which indicates the cost
-    // of travel across the terrain. Zero means the least possible difficulty
-    // in travelling (think ice rink if you can skate) whilst 5 represents the
-    // most difficult. 9 indicates that we cannot pass.
-
-    // Create an instance of the search class...
-
-    struct QuoridorMapInfo Map;
-    Map.vwalls = vwalls;
-    Map.hwalls = hwalls;
-    Map.map_width = vwalls[0].size();
-    Map.map_height = vwalls[0].size();
-
-    AStarSearch<QuoridorMapSearchNode> astarsearch;
-
-    // QuoridorMapSearchNode nodeStart;
-    QuoridorMapSearchNode nodeStart = QuoridorMapSearchNode(start_x, start_y, Map);
-    QuoridorMapSearchNode nodeEnd(end_x, end_y, Map);
-
-    // Set Start and goal states
-    astarsearch.SetStartAndGoalStates(nodeStart, nodeEnd);
-
-    unsigned int SearchState;
-    do {
-        SearchState = astarsearch.SearchStep();
-    } while (SearchState == AStarSearch<QuoridorMapSearchNode>::SEARCH_STATE_SEARCHING);
-
-
-    if (SearchState == AStarSearch<QuoridorMapSearchNode>::SEARCH_STATE_SUCCEEDED) {
-        astarsearch.FreeSolutionNodes();
-        astarsearch.EnsureMemoryFreed();
-        return true;
-
-    }
-    astarsearch.EnsureMemoryFreed();
-    return false;
+        const WallArray &vwalls,
+        const WallArray &hwalls) {
+    int board_size = boardSize(vwalls, hwalls);
+    py::gil_scoped_release release;
+    return withBitboard(board_size, [&](auto w) {
+        auto board = makeBoard<decltype(w)::value>(board_size, vwalls, hwalls);
+        return board.canReachRow(start_x, start_y, end_y);
+    });
 }
 
 
 inline std::tuple<std::vector<int>, int> findPath(
         std::vector<int> &start,
         std::vector<int> &end,
-        const std::vector<std::vector<int>> &vwalls,
-        const std::vector<std::vector<int>> &hwalls) {
+        const WallArray &vwalls,
+        const WallArray &hwalls) {
+    int board_size = boardSize(vwalls, hwalls);
 
     // std::cout << "STL A* Search implementation\n(C)2001 Justin Heyes-Jones\n";
 
@@ -220,10 +124,11 @@ inline std::tuple<std::vector<int>, int> findPath(
     // Create an instance of the search class...
 
     struct QuoridorMapInfo Map;
-    Map.vwalls = vwalls;
-    Map.hwalls = hwalls;
-    Map.map_width = vwalls[0].size();
-    Map.map_height = vwalls[0].size();
+    Map.vwalls = wallVector(vwalls);
+    Map.hwalls = wallVector(hwalls);
+    Map.map_width = board_size - 1;
+    Map.map_height = board_size - 1;
+    py::gil_scoped_release release;
 
     AStarSearch<QuoridorMapSearchNode> astarsearch;
 
@@ -314,312 +219,437 @@ inline std::tuple<std::vector<int>, int> findPath(
 }
 
 
-inline bool canPlaceWall(int px, int py, int pgx, int pgy,
-                         int ox, int oy, int ogx, int ogy,
-                         int wx, int wy, bool is_vertical,
-                         std::vector<std::vector<int>> &vwalls,
-                         std::vector<std::vector<int>> &hwalls) {
-    if (is_vertical)
-        vwalls[wx][wy] = 1;
-    else
-        hwalls[wx][wy] = 1;
-
-    bool res = pathExists(px, py, pgx, pgy, vwalls, hwalls) && pathExists(ox, oy, ogx, ogy, vwalls, hwalls);
-
-    if (is_vertical)
-        vwalls[wx][wy] = 0;
-    else
-        hwalls[wx][wy] = 0;
+inline std::tuple<Buffer, Buffer>
+getWallActions(int px, int py, int pgx, int pgy,
+               int ox, int oy, int ogx, int ogy,
+               const WallArray &vwalls,
+               const WallArray &hwalls,
+               int num_walls,
+               OptionalBuffer vwall_out,
+               OptionalBuffer hwall_out) {
+    int board_size = boardSize(vwalls, hwalls);
+    Buffer vwall_actions = outputBuffer(vwall_out, {board_size - 1, board_size - 1}, "vwall_out");
+    Buffer hwall_actions = outputBuffer(hwall_out, {board_size - 1, board_size - 1}, "hwall_out");
+    if (num_walls > 0) {
+        int16_t *vdata = vwall_actions.mutable_data();
+        int16_t *hdata = hwall_actions.mutable_data();
+        py::gil_scoped_release release;
+        withBitboard(board_size, [&](auto w) {
+            auto board = makeBoard<decltype(w)::value>(board_size, vwalls, hwalls);
+            Bits<decltype(w)::value> legal_v, legal_h;
+            board.wallActions(px, py, pgy, ox, oy, ogy, legal_v, legal_h);
+            writeWalls(board, legal_v, vdata);
+            writeWalls(board, legal_h, hdata);
+        });
+    }
 
-    return res;
+    return {vwall_actions, hwall_actions};
 }
 
-inline void setWallActions(int px, int py, int pgx, int pgy,
-                           int ox, int oy, int ogx, int ogy,
-                           std::vector<std::vector<int>> &vwalls,
-                           std::vector<std::vector<int>> &hwalls,
-                           std::vector<std::vector<int>> &vwall_actions,
-                           std::vector<std::vector<int>> &hwall_actions) {
-    int board_size = (int) vwalls.size();
-    for (int i = 0; i < board_size; ++i) {
-        for (int j = 0; j < board_size; ++j) {
-            // Vwalls
-            if ((vwalls[i][j] == 0) &&
-                (j + 1 >= board_size || vwalls[i][j + 1] == 0) &&
-                (j - 1 < 0 || vwalls[i][j - 1] == 0) &&
-                (hwalls[i][j] == 0)) {
-
-                int connections = 0;
-                if ((j + 1 >= board_size) ||
-                    (hwalls[i][j + 1] == 1) ||
-                    (i - 1 >= 0 && hwalls[i - 1][j + 1] == 1) ||
-                    (i + 1 < board_size && hwalls[i + 1][j + 1] == 1) ||
-                    (j + 2 < board_size && vwalls[i][j + 2] == 1))
-                    connections += 1;
-                if ((j - 1 < 0) ||
-                    (hwalls[i][j - 1] == 1) ||
-                    (i - 1 >= 0 && hwalls[i - 1][j - 1] == 1) ||
-                    (i + 1 < board_size && hwalls[i + 1][j - 1] == 1) ||
-                    (j - 2 >= 0 && vwalls[i][j - 2] == 1))
-                    connections += 1;
-                if ((i - 1 >= 0 && hwalls[i - 1][j] == 1) ||
-                    (i + 1 < board_size && hwalls[i + 1][j] == 1))
-                    connections += 1;
-
-                if (connections < 2 ||
-                    canPlaceWall(px, py, pgx, pgy, ox, oy, ogx, ogy, i, j, true, vwalls, hwalls)) {
-                    vwall_actions[i][j] = 1;
-                }
-            }
+inline std::tuple<Buffer, Buffer>
+updateWallActions(int px, int py, int pgx, int pgy,
+                  int ox, int oy, int ogx, int ogy,
+                  const WallArray &vwalls,
+                  const WallArray &hwalls,
+                  OptionalBuffer vwall_out,
+                  OptionalBuffer hwall_out) {
+    return getWallActions(px, py, pgx, pgy, ox, oy, ogx, ogy, vwalls, hwalls, 1, vwall_out, hwall_out);
+}
 
-            // Hwalls
-            if ((hwalls[i][j] == 0) &&
-                (i + 1 >= board_size || hwalls[i + 1][j] == 0) &&
-                (i - 1 < 0 || hwalls[i - 1][j] == 0) &&
-                (vwalls[i][j] == 0)) {
-
-                int connections = 0;
-                if ((i + 1 >= board_size) ||
-                    (vwalls[i + 1][j] == 1) ||
-                    (j - 1 >= 0 && vwalls[i + 1][j - 1] == 1) ||
-                    (j + 1 < board_size && vwalls[i + 1][j + 1] == 1) ||
-                    (i + 2 < board_size && hwalls[i + 2][j] == 1))
-                    connections += 1;
-
-                if ((i - 1 < 0) ||
-                    (vwalls[i - 1][j] == 1) ||
-                    (j - 1 >= 0 && vwalls[i - 1][j - 1] == 1) ||
-                    (j + 1 < board_size && vwalls[i - 1][j + 1] == 1) ||
-                    (i - 2 >= 0 && hwalls[i - 2][j] == 1))
-                    connections += 1;
-
-                if ((j - 1 >= 0 && vwalls[i][j - 1] == 1) ||
-                    (j + 1 < board_size && vwalls[i][j + 1] == 1))
-                    connections += 1;
-
-                if (connections < 2 ||
-                    canPlaceWall(px, py, pgx, pgy, ox, oy, ogx, ogy, i, j, false, vwalls, hwalls)) {
-                    hwall_actions[i][j] = 1;
-                }
+inline Buffer getValidActions(int px, int py, int pgx, int pgy,
+                              int ox, int oy, int ogx, int ogy,
+                              const WallArray &vwalls,
+                              const WallArray &hwalls,
+                              int num_walls,
+                              OptionalBuffer out) {
+    int board_size = boardSize(vwalls, hwalls);
+    int m = board_size - 1;
+    Buffer actions = outputBuffer(out, {12 + 2 * m * m}, "out");
+    int16_t *data = actions.mutable_data();
+
+    {
+        py::gil_scoped_release release;
+        withBitboard(board_size, [&](auto w) {
+            auto board = makeBoard<decltype(w)::value>(board_size, vwalls, hwalls);
+            board.pawnActions(px, py, ox, oy, data);
+
+            if (num_walls > 0) {
+                Bits<decltype(w)::value> legal_v, legal_h;
+                board.wallActions(px, py, pgy, ox, oy, ogy, legal_v, legal_h);
+
+                int n = board.n;
+                int pawn_actions_shift = 12;
+                int vwall_actions_shift = pawn_actions_shift + (m * m);
+                legal_v.forEach([&](int i) { data[pawn_actions_shift + (i % n) * m + i / n] = 1; });
+                legal_h.forEach([&](int i) { data[vwall_actions_shift + (i % n) * m + i / n] = 1; });
             }
-        }
+        });
     }
+
+    return actions;
 }
 
-inline void updateWallActions_(int px, int py, int pgx, int pgy,
-                               int ox, int oy, int ogx, int ogy,
-                               std::vector<std::vector<int>> &vwalls,
-                               std::vector<std::vector<int>> &hwalls,
-                               std::vector<std::vector<int>> &vwall_actions,
-                               std::vector<std::vector<int>> &hwall_actions) {
-    int board_size = (int) vwalls.size();
-    for (int i = 0; i < board_size; ++i) {
-        for (int j = 0; j < board_size; ++j) {
-            // Vwalls
-            if ((vwalls[i][j] == 0) &&
-                (j + 1 >= board_size || vwalls[i][j + 1] == 0) &&
-                (j - 1 < 0 || vwalls[i][j - 1] == 0) &&
-                (hwalls[i][j] == 0)) {
-
-                int connections = 0;
-                if ((j + 1 >= board_size) ||
-                    (hwalls[i][j + 1] == 1) ||
-                    (i - 1 >= 0 && hwalls[i - 1][j + 1] == 1) ||
-                    (i + 1 < board_size && hwalls[i + 1][j + 1] == 1) ||
-                    (j + 2 < board_size && vwalls[i][j + 2] == 1))
-                    connections += 1;
-                if ((j - 1 < 0) ||
-                    (hwalls[i][j - 1] == 1) ||
-                    (i - 1 >= 0 && hwalls[i - 1][j - 1] == 1) ||
-                    (i + 1 < board_size && hwalls[i + 1][j - 1] == 1) ||
-                    (j - 2 >= 0 && vwalls[i][j - 2] == 1))
-                    connections += 1;
-                if ((i - 1 >= 0 && hwalls[i - 1][j] == 1) ||
-                    (i + 1 < board_size && hwalls[i + 1][j] == 1))
-                    connections += 1;
-
-                if (connections < 2 ||
-                    canPlaceWall(px, py, pgx, pgy, ox, oy, ogx, ogy, i, j, true, vwalls, hwalls)) {
-                    vwall_actions[i][j] = 1;
-                }
-            }
 
-            // Hwalls
-            if ((hwalls[i][j] == 0) &&
-                (i + 1 >= board_size || hwalls[i + 1][j] == 0) &&
-                (i - 1 < 0 || hwalls[i - 1][j] == 0) &&
-                (vwalls[i][j] == 0)) {
-
-                int connections = 0;
-                if ((i + 1 >= board_size) ||
-                    (vwalls[i + 1][j] == 1) ||
-                    (j - 1 >= 0 && vwalls[i + 1][j - 1] == 1) ||
-                    (j + 1 < board_size && vwalls[i + 1][j + 1] == 1) ||
-                    (i + 2 < board_size && hwalls[i + 2][j] == 1))
-                    connections += 1;
-
-                if ((i - 1 < 0) ||
-                    (vwalls[i - 1][j] == 1) ||
-                    (j - 1 >= 0 && vwalls[i - 1][j - 1] == 1) ||
-                    (j + 1 < board_size && vwalls[i - 1][j + 1] == 1) ||
-                    (i - 2 >= 0 && hwalls[i - 2][j] == 1))
-                    connections += 1;
-
-                if ((j - 1 >= 0 && vwalls[i][j - 1] == 1) ||
-                    (j + 1 < board_size && vwalls[i][j + 1] == 1))
-                    connections += 1;
-
-                if (connections < 2 ||
-                    canPlaceWall(px, py, pgx, pgy, ox, oy, ogx, ogy, i, j, false, vwalls, hwalls)) {
-                    hwall_actions[i][j] = 1;
-                }
+inline std::tuple<Buffer, Buffer> getPathMatrices(
+        const WallArray &vwalls,
+        const WallArray &hwalls,
+        OptionalBuffer red_out,
+        OptionalBuffer blue_out) {
+    int board_size = boardSize(vwalls, hwalls);
+    Buffer path_red = outputBuffer(red_out, {board_size, board_size}, "red_out");
+    Buffer path_blue = outputBuffer(blue_out, {board_size, board_size}, "blue_out");
+    int16_t *red_data = path_red.mutable_data();
+    int16_t *blue_data = path_blue.mutable_data();
+
+    {
+        py::gil_scoped_release release;
+        withBitboard(board_size, [&](auto w) {
+            auto board = makeBoard<decltype(w)::value>(board_size, vwalls, hwalls);
+            std::vector<int16_t> paths(2 * board_size * board_size);
+            WallKey key = wallKey(board, nullptr);
+            if (!pathCache().get(key, paths.data())) {
+                board.distances(board_size - 1, paths.data());
+                board.distances(0, paths.data() + board_size * board_size);
+                pathCache().put(key, paths.data(), paths.size());
             }
-        }
+            std::copy(paths.begin(), paths.begin() + board_size * board_size, red_data);
+            std::copy(paths.begin() + board_size * board_size, paths.end(), blue_data);
+        });
     }
-}
-
-inline std::tuple<std::vector<std::vector<int>>, std::vector<std::vector<int>>>
-getWallActions(int px, int py, int pgx, int pgy,
-               int ox, int oy, int ogx, int ogy,
-               std::vector<std::vector<int>> &vwalls,
-               std::vector<std::vector<int>> &hwalls,
-               int num_walls) {
-
-    int board_size = (int) vwalls.size();
-    std::vector<std::vector<int>> vwall_actions(board_size, std::vector<int>(board_size, 0));
-    std::vector<std::vector<int>> hwall_actions(board_size, std::vector<int>(board_size, 0));
-    if (num_walls > 0)
-        setWallActions(px, py, pgx, pgy, ox, oy, ogx, ogy, vwalls, hwalls, vwall_actions, hwall_actions);
 
-    return {vwall_actions, hwall_actions};
+    return {path_red, path_blue};
 }
 
-inline std::tuple<std::vector<std::vector<int>>, std::vector<std::vector<int>>>
-updateWallActions(int px, int py, int pgx, int pgy,
-                  int ox, int oy, int ogx, int ogy,
-                  std::vector<std::vector<int>> &vwalls,
-                  std::vector<std::vector<int>> &hwalls) {
 
-    int board_size = (int) vwalls.size();
-    std::vector<std::vector<int>> vwall_actions(board_size, std::vector<int>(board_size, 0));
-    std::vector<std::vector<int>> hwall_actions(board_size, std::vector<int>(board_size, 0));
-    updateWallActions_(px, py, pgx, pgy, ox, oy, ogx, ogy,
-                       vwalls, hwalls,
-                       vwall_actions, hwall_actions);
+// Offsets of the state buffer fields for an n x n board, see StateLayout
+inline py::dict stateLayout(int board_size) {
+    if (board_size < 3) throw std::invalid_argument("QuoridorUtils: board size must be at least 3");
+    withBitboard(board_size, [](auto) {});
+    StateLayout l(board_size);
+    py::dict layout;
+    layout["words"] = l.words;
+    layout["walls"] = l.walls;
+    layout["key_size"] = l.key_size;
+    layout["mirror"] = l.mirror;
+    layout["paths_red"] = l.paths_red;
+    layout["paths_blue"] = l.paths_blue;
+    layout["red_cuts"] = l.red_cuts;
+    layout["blue_cuts"] = l.blue_cuts;
+    layout["legal_walls"] = l.legal_walls;
+    layout["valid_red"] = l.valid_red;
+    layout["valid_blue"] = l.valid_blue;
+    layout["action_size"] = l.action_size;
+    layout["size"] = l.size;
+    return layout;
+}
 
-    return {vwall_actions, hwall_actions};
+inline StateLayout checkState(const Buffer &state, int board_size) {
+    if (board_size < 3) throw std::invalid_argument("QuoridorUtils: board size must be at least 3");
+    StateLayout l(board_size);
+    checkShape(state, {l.size}, "state");
+    return l;
 }
 
-inline std::vector<int> getValidActions(int px, int py, int pgx, int pgy,
-                                        int ox, int oy, int ogx, int ogy,
-                                        std::vector<std::vector<int>> &vwalls,
-                                        std::vector<std::vector<int>> &hwalls,
-                                        int num_walls) {
-    int board_size = (int) vwalls.size();
-    int action_size = 12 + 2 * board_size * board_size;
-    std::vector<int> actions(action_size, 0);
-    setPawnActions(px, py, ox, oy, vwalls, hwalls, actions);
+// Fills the derived fields of a state from its pawns and walls
+inline void refreshState(Buffer state, int board_size) {
+    StateLayout l = checkState(state, board_size);
+    int16_t *s = state.mutable_data();
+    py::gil_scoped_release release;
+    withBitboard(board_size, [&](auto w) { refreshState<decltype(w)::value>(l, s); });
+}
 
-    if (num_walls > 0) {
-        std::vector<std::vector<int>> vwall_actions(board_size, std::vector<int>(board_size, 0));
-        std::vector<std::vector<int>> hwall_actions(board_size, std::vector<int>(board_size, 0));
-        setWallActions(px, py, pgx, pgy, ox, oy, ogx, ogy, vwalls, hwalls, vwall_actions, hwall_actions);
+// Applies an action to a state in place, see applyAction in QuoridorState.h
+inline void applyAction(Buffer state, int board_size, int player, int action, bool incremental) {
+    StateLayout l = checkState(state, board_size);
+    if (player != 1 && player != -1) throw std::invalid_argument("QuoridorUtils: player must be 1 or -1");
+    if (action < 0 || action >= l.action_size) throw std::invalid_argument("QuoridorUtils: action out of range");
+    int16_t *s = state.mutable_data();
+    py::gil_scoped_release release;
+    withBitboard(board_size, [&](auto w) { applyAction<decltype(w)::value>(l, s, player, action, incremental); });
+}
 
-        for (int i = 0; i < board_size; ++i) {
-            for (int j = 0; j < board_size; ++j) {
-                int pawn_actions_shift = 12;
-                actions[pawn_actions_shift + i * board_size + j] = vwall_actions[i][j];
+// Outcome of the pawn race of a state seen from perspective (1 or -1), for the
+// player to move, see raceResult in QuoridorRace.h. Meaningful once both
+// players are out of walls.
+inline int raceResult(const Buffer &state, int board_size, int perspective, bool red_to_move) {
+    StateLayout l = checkState(state, board_size);
+    if (perspective != 1 && perspective != -1) throw std::invalid_argument("QuoridorUtils: perspective must be 1 or -1");
+    const int16_t *s = state.data() + (perspective == 1 ? 0 : l.mirror);
+    py::gil_scoped_release release;
+    return withBitboard(board_size, [&](auto w) { return raceResult<decltype(w)::value>(l, s, red_to_move); });
+}
 
-                int vwall_actions_shift = pawn_actions_shift + (board_size * board_size);
-                actions[vwall_actions_shift + i * board_size + j] = hwall_actions[i][j];
+// Network input of a batch of states, see encodeState in QuoridorState.h.
+// states is (B, size), with a perspective and a draw flag per state. The
+// features of state b are written to row b of planes (R, 2, n, n), walls
+// (R, 2, n - 1, n - 1) and values (R, 17), which may hold more rows than
+// needed. With mirror, the features of the mirrored board also go to row B + b.
+inline void encodeStates(const WallArray &states, int board_size, const std::vector<int> &perspectives,
+                         const std::vector<int> &draws, FloatBuffer planes, FloatBuffer walls, FloatBuffer values,
+                         bool mirror) {
+    if (board_size < 3) throw std::invalid_argument("QuoridorUtils: board size must be at least 3");
+    StateLayout l(board_size);
+    int count = states.ndim() == 2 ? (int) states.shape(0) : -1;
+    checkShape(states, {count, l.size}, "states");
+    if ((int) perspectives.size() != count || (int) draws.size() != count)
+        throw std::invalid_argument("QuoridorUtils: one perspective and draw flag expected per state");
+    int n = l.n, m = l.m;
+    int rows = planes.ndim() == 4 ? (int) planes.shape(0) : -1;
+    checkShape(planes, {rows, 2, n, n}, "planes");
+    checkShape(walls, {rows, 2, m, m}, "walls");
+    checkShape(values, {rows, 17}, "values");
+    if (rows < (mirror ? 2 : 1) * count)
+        throw std::invalid_argument("QuoridorUtils: feature buffers too small for the batch");
+    for (int perspective : perspectives) {
+        if (perspective != 1 && perspective != -1)
+            throw std::invalid_argument("QuoridorUtils: perspective must be 1 or -1");
+    }
+    const int16_t *s = states.data();
+    float *p = planes.mutable_data(), *w = walls.mutable_data(), *v = values.mutable_data();
+    py::gil_scoped_release release;
+    withBitboard(board_size, [&](auto bits) {
+        for (int b = 0; b < count; ++b) {
+            for (int mirrored = 0; mirrored <= (int) mirror; ++mirrored) {
+                int row = b + mirrored * count;
+                encodeState<decltype(bits)::value>(l, s + b * l.size, perspectives[b], draws[b] != 0, mirrored,
+                                                   p + row * 2 * n * n, w + row * 2 * m * m, v + row * 17);
             }
         }
-    }
-
-    return actions;
+    });
 }
 
+// Sets the number of entries kept by the path and legal wall caches, and by the
+// race cache if race_entries is given (its entries are whole race tables, so it
+// has its own budget); 0 disables them
+inline void setCacheCapacity(size_t entries, std::optional<size_t> race_entries) {
+    pathCache().setCapacity(entries);
+    wallCache().setCapacity(entries);
+    if (race_entries)
+        raceCache().setCapacity(*race_entries);
+}
 
-typedef struct QNode {
-    int x;
-    int y;
+inline void clearCache() {
+    pathCache().clear();
+    wallCache().clear();
+    raceCache().clear();
+}
 
-    QNode(int _x, int _y) : x(_x), y(_y) {}
-} QNode;
+// Hits, misses, entries and capacity of the path, legal wall and race caches
+inline py::dict cacheStats() {
+    py::dict stats;
+    for (auto cache : {std::make_pair("paths", &pathCache()), std::make_pair("walls", &wallCache()),
+                       std::make_pair("race", &raceCache())}) {
+        WallCache::Stats s = cache.second->stats();
+        py::dict d;
+        d["hits"] = s.hits;
+        d["misses"] = s.misses;
+        d["entries"] = s.entries;
+        d["capacity"] = s.capacity;
+        stats[cache.first] = d;
+    }
+    return stats;
+}
 
-inline void calculatePathMatrix(
-        const std::vector<std::vector<int>> &vwalls,
-        const std::vector<std::vector<int>> &hwalls,
-        std::vector<std::vector<int>> &path,
-        queue<QNode> &q) {
+// Runs f(b) for every b in [0, count), split in contiguous chunks over up to
+// num_threads threads (0 uses one per core). Must be called without the GIL.
+template<typename F>
+inline void parallelFor(int count, int num_threads, F f) {
+    const int min_chunk = 16;
+    if (num_threads <= 0) num_threads = (int) std::max(1u, std::thread::hardware_concurrency());
+    num_threads = std::min(num_threads, std::max(1, count / min_chunk));
+    if (num_threads == 1) {
+        for (int b = 0; b < count; ++b) f(b);
+        return;
+    }
+    std::vector<std::thread> threads;
+    for (int t = 0; t < num_threads; ++t) {
+        int begin = (int) ((long) count * t / num_threads);
+        int end = (int) ((long) count * (t + 1) / num_threads);
+        threads.emplace_back([&f, begin, end]() { for (int b = begin; b < end; ++b) f(b); });
+    }
+    for (auto &thread : threads) thread.join();
+}
 
-    while (!q.empty()) {
-        QNode n = q.front();
-        q.pop();
-//        std::cout << "Pop: " <<  n.x << ' '<<  n.y << '\n';
-        // check north neighbor
-        if (!hasHWN(hwalls, n.x, n.y) && (path[n.x][n.y + 1] > path[n.x][n.y] + 1)) {
-            q.push(QNode(n.x, n.y + 1));
+// Batch size from stacked (B, n - 1, n - 1) wall arrays
+inline int batchSize(const WallArray &vwalls, const WallArray &hwalls, int &board_size) {
+    int count = vwalls.ndim() == 3 ? (int) vwalls.shape(0) : -1;
+    int m = vwalls.ndim() == 3 ? (int) vwalls.shape(1) : -1;
+    checkShape(vwalls, {count, m, m}, "vwalls");
+    checkShape(hwalls, {count, m, m}, "hwalls");
+    board_size = m + 1;
+    return count;
+}
 
-//            std::cout << "Add: " <<  n.x << ' '<<  n.y+1 << '\n';
-            path[n.x][n.y + 1] = path[n.x][n.y] + 1;
-        }
-        // check south neighbor
-        if (!hasHWN(hwalls, n.x, n.y - 1) && (path[n.x][n.y - 1] > path[n.x][n.y] + 1)) {
-            q.push(QNode(n.x, n.y - 1));
-//            std::cout << "Add: " <<  n.x << ' '<<  n.y+1 << '\n';
-            path[n.x][n.y - 1] = path[n.x][n.y] + 1;
-        }
-        // check east neighbor
-        if (!hasVWE(vwalls, n.x, n.y) && (path[n.x + 1][n.y] > path[n.x][n.y] + 1)) {
-            q.push(QNode(n.x + 1, n.y));
-//            std::cout << "Add: " <<  n.x+1 << ' '<<  n.y << '\n';
-            path[n.x + 1][n.y] = path[n.x][n.y] + 1;
-        }
-        // check west neighbor
-        if (!hasVWE(vwalls, n.x - 1, n.y) && (path[n.x - 1][n.y] > path[n.x][n.y] + 1)) {
-            q.push(QNode(n.x - 1, n.y));
-//            std::cout << "Add: " <<  n.x << ' '<<  n.y+1 << '\n';
-            path[n.x - 1][n.y] = path[n.x][n.y] + 1;
-        }
+// Batch versions of the functions above. Walls are stacked in (B, n - 1, n - 1)
+// arrays; positions is (B, 4) with the player and opponent pawns (px, py, ox,
+// oy), goals is (B, 2) with their goal rows and num_walls (B,) holds the walls
+// left to the player.
+
+inline std::tuple<Buffer, Buffer> getPathMatricesBatch(
+        const WallArray &vwalls,
+        const WallArray &hwalls,
+        OptionalBuffer red_out,
+        OptionalBuffer blue_out,
+        int num_threads) {
+    int board_size;
+    int count = batchSize(vwalls, hwalls, board_size);
+    int m = board_size - 1;
+    Buffer path_red = outputBuffer(red_out, {count, board_size, board_size}, "red_out");
+    Buffer path_blue = outputBuffer(blue_out, {count, board_size, board_size}, "blue_out");
+    int16_t *red_data = path_red.mutable_data();
+    int16_t *blue_data = path_blue.mutable_data();
+    const int16_t *v = vwalls.data();
+    const int16_t *h = hwalls.data();
+
+    {
+        py::gil_scoped_release release;
+        withBitboard(board_size, [&](auto w) {
+            parallelFor(count, num_threads, [&](int b) {
+                QuoridorBitboard<decltype(w)::value> board(board_size, v + b * m * m, h + b * m * m);
+                board.distances(board_size - 1, red_data + b * board_size * board_size);
+                board.distances(0, blue_data + b * board_size * board_size);
+            });
+        });
     }
+
+    return {path_red, path_blue};
 }
 
-inline std::tuple<std::vector<std::vector<int>>, std::vector<std::vector<int>>> getPathMatrices(
-        const std::vector<std::vector<int>> &vwalls,
-        const std::vector<std::vector<int>> &hwalls) {
-    int board_size = (int) hwalls.size() + 1;
-    int max = board_size * board_size + 1;
-    std::vector<std::vector<int>> path_red(board_size, std::vector<int>(board_size, max));
-    std::vector<std::vector<int>> path_blue(board_size, std::vector<int>(board_size, max));
-    queue<QNode> q;
-
-    for (int i = 0; i < board_size; ++i) {
-        path_red[i][board_size - 1] = 0;
-        QNode n(i, board_size - 1);
-        q.push(n);
+inline std::tuple<Buffer, Buffer> updateWallActionsBatch(
+        const WallArray &positions,
+        const WallArray &goals,
+        const WallArray &vwalls,
+        const WallArray &hwalls,
+        OptionalBuffer vwall_out,
+        OptionalBuffer hwall_out,
+        int num_threads) {
+    int board_size;
+    int count = batchSize(vwalls, hwalls, board_size);
+    int m = board_size - 1;
+    checkShape(positions, {count, 4}, "positions");
+    checkShape(goals, {count, 2}, "goals");
+    Buffer vwall_actions = outputBuffer(vwall_out, {count, m, m}, "vwall_out");
+    Buffer hwall_actions = outputBuffer(hwall_out, {count, m, m}, "hwall_out");
+    int16_t *vdata = vwall_actions.mutable_data();
+    int16_t *hdata = hwall_actions.mutable_data();
+    const int16_t *pos = positions.data();
+    const int16_t *goal = goals.data();
+    const int16_t *v = vwalls.data();
+    const int16_t *h = hwalls.data();
+
+    {
+        py::gil_scoped_release release;
+        withBitboard(board_size, [&](auto w) {
+            parallelFor(count, num_threads, [&](int b) {
+                QuoridorBitboard<decltype(w)::value> board(board_size, v + b * m * m, h + b * m * m);
+                const int16_t *p = pos + 4 * b;
+                Bits<decltype(w)::value> legal_v, legal_h;
+                board.wallActions(p[0], p[1], goal[2 * b], p[2], p[3], goal[2 * b + 1], legal_v, legal_h);
+                writeWalls(board, legal_v, vdata + b * m * m);
+                writeWalls(board, legal_h, hdata + b * m * m);
+            });
+        });
     }
-    calculatePathMatrix(vwalls, hwalls, path_red, q);
 
-    for (int i = 0; i < board_size; ++i) {
-        path_blue[i][0] = 0;
-        QNode n(i, 0);
-        q.push(n);
+    return {vwall_actions, hwall_actions};
+}
+
+inline Buffer getValidActionsBatch(
+        const WallArray &positions,
+        const WallArray &goals,
+        const WallArray &vwalls,
+        const WallArray &hwalls,
+        const WallArray &num_walls,
+        OptionalBuffer out,
+        int num_threads) {
+    int board_size;
+    int count = batchSize(vwalls, hwalls, board_size);
+    int m = board_size - 1;
+    int action_size = 12 + 2 * m * m;
+    checkShape(positions, {count, 4}, "positions");
+    checkShape(goals, {count, 2}, "goals");
+    checkShape(num_walls, {count}, "num_walls");
+    Buffer actions = outputBuffer(out, {count, action_size}, "out");
+    int16_t *data = actions.mutable_data();
+    const int16_t *pos = positions.data();
+    const int16_t *goal = goals.data();
+    const int16_t *walls_left = num_walls.data();
+    const int16_t *v = vwalls.data();
+    const int16_t *h = hwalls.data();
+
+    {
+        py::gil_scoped_release release;
+        withBitboard(board_size, [&](auto w) {
+            parallelFor(count, num_threads, [&](int b) {
+                QuoridorBitboard<decltype(w)::value> board(board_size, v + b * m * m, h + b * m * m);
+                const int16_t *p = pos + 4 * b;
+                int16_t *row = data + b * action_size;
+                board.pawnActions(p[0], p[1], p[2], p[3], row);
+                if (walls_left[b] > 0) {
+                    Bits<decltype(w)::value> legal_v, legal_h;
+                    board.wallActions(p[0], p[1], goal[2 * b], p[2], p[3], goal[2 * b + 1], legal_v, legal_h);
+                    writeWalls(board, legal_v, row + 12);
+                    writeWalls(board, legal_h, row + 12 + m * m);
+                }
+            });
+        });
     }
-    calculatePathMatrix(vwalls, hwalls, path_blue, q);
 
-    return {path_red, path_blue};
+    return actions;
 }
 
 
 inline PYBIND11_MODULE(QuoridorUtils, module) {
+    using namespace pybind11::literals;
     module.doc() = "Quoridor Utils for engine V2";
 
     module.def("pathExists", &pathExists, "");
     module.def("findPath", &findPath, "");
-    module.def("getPawnActions", &getPawnActions, "");
-    module.def("getWallActions", &getWallActions, "");
-    module.def("getValidActions", &getValidActions, "");
-    module.def("updateWallActions", &updateWallActions, "");
-    module.def("getPathMatrices", &getPathMatrices, "");
+    module.def("getPawnActions", &getPawnActions, "",
+               "player_x"_a, "player_y"_a, "opponent_x"_a, "opponent_y"_a, "vwalls"_a, "hwalls"_a,
+               py::arg("out").noconvert() = py::none());
+    module.def("getWallActions", &getWallActions, "",
+               "px"_a, "py"_a, "pgx"_a, "pgy"_a, "ox"_a, "oy"_a, "ogx"_a, "ogy"_a, "vwalls"_a, "hwalls"_a,
+               "num_walls"_a, py::arg("vwall_out").noconvert() = py::none(),
+               py::arg("hwall_out").noconvert() = py::none());
+    module.def("getValidActions", &getValidActions, "",
+               "px"_a, "py"_a, "pgx"_a, "pgy"_a, "ox"_a, "oy"_a, "ogx"_a, "ogy"_a, "vwalls"_a, "hwalls"_a,
+               "num_walls"_a, py::arg("out").noconvert() = py::none());
+    module.def("updateWallActions", &updateWallActions, "",
+               "px"_a, "py"_a, "pgx"_a, "pgy"_a, "ox"_a, "oy"_a, "ogx"_a, "ogy"_a, "vwalls"_a, "hwalls"_a,
+               py::arg("vwall_out").noconvert() = py::none(), py::arg("hwall_out").noconvert() = py::none());
+    module.def("getPathMatrices", &getPathMatrices, "",
+               "vwalls"_a, "hwalls"_a, py::arg("red_out").noconvert() = py::none(),
+               py::arg("blue_out").noconvert() = py::none());
+    module.def("getPathMatricesBatch", &getPathMatricesBatch, "",
+               "vwalls"_a, "hwalls"_a, py::arg("red_out").noconvert() = py::none(),
+               py::arg("blue_out").noconvert() = py::none(), "num_threads"_a = 0);
+    module.def("updateWallActionsBatch", &updateWallActionsBatch, "",
+               "positions"_a, "goals"_a, "vwalls"_a, "hwalls"_a, py::arg("vwall_out").noconvert() = py::none(),
+               py::arg("hwall_out").noconvert() = py::none(), "num_threads"_a = 0);
+    module.def("getValidActionsBatch", &getValidActionsBatch, "",
+               "positions"_a, "goals"_a, "vwalls"_a, "hwalls"_a, "num_walls"_a,
+               py::arg("out").noconvert() = py::none(), "num_threads"_a = 0);
+
+    module.attr("RED_X") = (int) StateLayout::RED_X;
+    module.attr("RED_Y") = (int) StateLayout::RED_Y;
+    module.attr("BLUE_X") = (int) StateLayout::BLUE_X;
+    module.attr("BLUE_Y") = (int) StateLayout::BLUE_Y;
+    module.attr("RED_WALLS") = (int) StateLayout::RED_WALLS;
+    module.attr("BLUE_WALLS") = (int) StateLayout::BLUE_WALLS;
+    module.attr("KEY") = (int) StateLayout::KEY;
+    module.attr("ZOBRIST_DRAW") = py::int_(zobrist(0, Z_DRAW, 0));
+    module.def("stateLayout", &stateLayout, "", "n"_a);
+    module.def("refreshState", py::overload_cast<Buffer, int>(&refreshState), "",
+               py::arg("state").noconvert(), "n"_a);
+    module.def("applyAction", py::overload_cast<Buffer, int, int, int, bool>(&applyAction), "",
+               py::arg("state").noconvert(), "n"_a, "player"_a, "action"_a, "incremental"_a = true);
+    module.def("setCacheCapacity", &setCacheCapacity, "", "entries"_a, "race_entries"_a = py::none());
+    module.def("clearCache", &clearCache, "");
+    module.def("cacheStats", &cacheStats, "");
+    module.def("raceResult", py::overload_cast<const Buffer &, int, int, bool>(&raceResult), "",
+               py::arg("state").noconvert(), "n"_a, "perspective"_a, "red_to_move"_a);
+    module.def("encodeStates", &encodeStates, "", "states"_a, "n"_a, "perspectives"_a, "draws"_a,
+               py::arg("planes").noconvert(), py::arg("walls").noconvert(), py::arg("values").noconvert(),
+               "mirror"_a = false);
 }
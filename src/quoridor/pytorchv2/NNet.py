@@ -11,6 +11,7 @@ from alphazero_general.NeuralNet import NeuralNet
 import torch
 import torch.optim as optim
 
+from ..QuoridorLogic import encodeBoards, featureBuffers
 from .QuoridorBigNNet import QuoridorNNet as qnnet
 
 args = dotdict({
@@ -35,6 +36,8 @@ class NNetWrapper(NeuralNet):
         self.nnet = qnnet(game, self.nn_args)
         self.boards, self.walls, self.values = game.getBoardSize()
         self.action_size = game.getActionSize()
+        # Network input of predict_batch, grown with the batches
+        self.inputs = featureBuffers(self.boards[0], 1)
         if self.nn_args.cuda:
             self.nnet.cuda()
 
@@ -60,9 +63,9 @@ class NNetWrapper(NeuralNet):
                 sample_ids = np.random.randint(len(examples), size=self.nn_args.batch_size)
                 nn_input, pis, vs = list(zip(*[examples[i] for i in sample_ids]))
                 boards, walls, values = list(zip(*[i for i in nn_input]))
-                boards = torch.FloatTensor(np.array(boards).astype(np.float64))
-                walls = torch.FloatTensor(np.array(walls).astype(np.float64))
-                values = torch.FloatTensor(np.array(values).astype(np.float64))
+                boards = torch.from_numpy(np.array(boards, np.float32))
+                walls = torch.from_numpy(np.array(walls, np.float32))
+                values = torch.from_numpy(np.array(values, np.float32))
                 target_pis = torch.FloatTensor(np.array(pis))
                 target_vs = torch.FloatTensor(np.array(vs).astype(np.float64))
 
@@ -94,24 +97,39 @@ class NNetWrapper(NeuralNet):
         """
         board: np array with board
         """
-        board, wall, value = board.getBoard()
-        # preparing input
-        board = torch.FloatTensor(board.astype(np.float64))
-        wall = torch.FloatTensor(wall.astype(np.float64))
-        value = torch.FloatTensor(value.astype(np.float64))
+        # the features memoized by the board, encoded at most once per position
+        pi, v = self.evaluate(*board.features())
+        return pi[0], v[0]
+
+    def predict_batch(self, boards):
+        """
+        boards: list of boards, encoded together and evaluated in one forward pass
+
+        Returns the policies (len(boards), action_size) and values (len(boards), 1)
+        """
+        count = len(boards)
+        if count > len(self.inputs[0]):
+            self.inputs = featureBuffers(self.boards[0], count)
+        encodeBoards(boards, *self.inputs)
+        return self.evaluate(*(feature[:count] for feature in self.inputs))
+
+    def evaluate(self, board, wall, value):
+        """
+        board, wall, value: float32 network input with a leading batch axis
+        """
+        # preparing input: the arrays are wrapped without a copy
+        board = torch.from_numpy(board)
+        wall = torch.from_numpy(wall)
+        value = torch.from_numpy(value)
         if self.nn_args.cuda:
-            board = board.contiguous().cuda()
-            wall = wall.contiguous().cuda()
-            value = value.contiguous().cuda()
-        board = board.view(self.boards[2], self.boards[0], self.boards[1])
-        wall = wall.view(self.walls[2], self.walls[0], self.walls[1])
-        value = value.view(self.values)
+            board = board.cuda()
+            wall = wall.cuda()
+            value = value.cuda()
         self.nnet.eval()
         with torch.no_grad():
             pi, v = self.nnet(board, wall, value)
 
-        # print('PREDICTION TIME TAKEN : {0:03f}'.format(time.time()-start))
-        return torch.exp(pi).data.cpu().numpy()[0], v.data.cpu().numpy()[0]
+        return torch.exp(pi).data.cpu().numpy(), v.data.cpu().numpy()
 
     def loss_pi(self, targets, outputs):
         return -torch.sum(targets * outputs) / targets.size()[0]
@@ -104,7 +104,7 @@ def simulate_search():
     while game_ended == 0:
         it += 1
         actions = game.getValidActions(board, 1)
-        action = np.random.choice(len(actions), p=actions / sum(actions))
+        action = np.random.choice(len(actions), p=actions / actions.sum())
         next_s, next_player = game.getNextState(board, 1, action)
         board = game.getCanonicalForm(next_s, next_player)
         game_ended = game.getGameEnded(board, 1)
@@ -0,0 +1,355 @@
+import argparse
+import random
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from alphazero_general.MCTSQuoridor import MCTS
+from alphazero_general.utils import dotdict
+from quoridor.QuoridorGame import QuoridorGame as Game
+from quoridor.QuoridorLogic import ActionTables, QuoridorBoard, QuoridorUtils, actionTables, encodeBoards, featureBuffers
+
+"""
+use this script to measure the speed of the game logic. Run it from src/, e.g.
+python -m tests.benchmark threads --n 9
+"""
+
+
+def random_positions(n, count, seed=0):
+    """
+    Plays random games and returns the positions reached, as the arguments of
+    QuoridorUtils.getValidActions.
+    """
+    game = Game(n)
+    rnd = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        board, player = game.getInitBoard(), 1
+        while game.getGameEnded(board, player) == 0 and len(positions) < count:
+            board = game.getCanonicalForm(board, player)
+            positions.append((board.red_position[0], board.red_position[1], n // 2, board.red_goal,
+                              board.blue_position[0], board.blue_position[1], n // 2, board.blue_goal,
+                              board.v_walls.copy(), board.h_walls.copy(), board.red_walls))
+            valids = game.getLegalActions(board, 1)
+            board, player = game.getNextState(board, 1, rnd.choice(list(valids)))
+    return positions
+
+
+def valid_actions_worker(positions, repeat):
+    for _ in range(repeat):
+        for position in positions:
+            QuoridorUtils.getValidActions(*position)
+            QuoridorUtils.getPathMatrices(position[8], position[9])
+
+
+def bench_threads(n, positions, repeat, max_threads):
+    """
+    Runs the same QuoridorUtils workload on 1, 2, 4, ... threads. The functions
+    release the GIL, so the throughput should grow with the number of threads
+    up to the number of cores.
+    """
+    positions = random_positions(n, positions)
+    base = None
+    threads = 1
+    while threads <= max_threads:
+        with ThreadPoolExecutor(threads) as pool:
+            start = time.perf_counter()
+            list(pool.map(valid_actions_worker, [positions] * threads, [repeat] * threads))
+            elapsed = time.perf_counter() - start
+        rate = threads * repeat * len(positions) / elapsed
+        base = base or rate
+        print(f'threads {threads:3d}  {rate:12.0f} positions/s  speedup {rate / base:5.2f}')
+        threads *= 2
+
+
+def bench_batch(n, positions, repeat, threads):
+    """
+    Compares one getValidActions call per position with a single
+    getValidActionsBatch call over all of them.
+    """
+    positions = random_positions(n, positions)
+    pawns = np.array([[p[0], p[1], p[4], p[5]] for p in positions], np.int16)
+    goals = np.array([[p[3], p[7]] for p in positions], np.int16)
+    v_walls = np.stack([p[8] for p in positions])
+    h_walls = np.stack([p[9] for p in positions])
+    num_walls = np.array([p[10] for p in positions], np.int16)
+    out = np.zeros((len(positions), 12 + 2 * (n - 1) ** 2), np.int16)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for position in positions:
+            QuoridorUtils.getValidActions(*position)
+    loop = (time.perf_counter() - start) / (repeat * len(positions))
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        QuoridorUtils.getValidActionsBatch(pawns, goals, v_walls, h_walls, num_walls, out, num_threads=threads)
+    batch = (time.perf_counter() - start) / (repeat * len(positions))
+    print(f'loop {loop * 1e6:8.2f} us/position  batch {batch * 1e6:8.2f} us/position  speedup {loop / batch:5.2f}')
+
+
+def bench_board(n, positions, repeat):
+    """
+    Reports the memory held by one board and the latency of copying it, as done
+    by getNextState and getCanonicalForm.
+    """
+    game = Game(n)
+    rnd = random.Random(0)
+    boards = []
+    board, player = game.getInitBoard(), 1
+    while len(boards) < positions:
+        if game.getGameEnded(board, player) != 0:
+            board, player = game.getInitBoard(), 1
+        boards.append(board)
+        valids = game.getLegalActions(game.getCanonicalForm(board, player), 1)
+        board, player = game.getNextState(board, player, rnd.choice(list(valids)))
+
+    clone = (lambda b: b.clone()) if hasattr(boards[0], 'clone') else (lambda b: type(b)(n, board=b))
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    copies = [clone(b) for b in boards]
+    size = (tracemalloc.get_traced_memory()[0] - before) / len(copies)
+    tracemalloc.stop()
+    del copies
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for b in boards:
+            clone(b)
+    latency = (time.perf_counter() - start) / (repeat * len(boards))
+    print(f'n {n}  {size:8.0f} bytes/board  clone {latency * 1e6:6.2f} us')
+
+
+def bench_tables(n, positions, repeat):
+    """
+    Compares building the action tables of a board with looking up the shared
+    ones, next to the cost of a clone and of the functions using the tables.
+    """
+    game = Game(n)
+    rnd = random.Random(0)
+    boards = []
+    board, player = game.getInitBoard(), 1
+    while len(boards) < positions:
+        if game.getGameEnded(board, player) != 0:
+            board, player = game.getInitBoard(), 1
+        board = game.getCanonicalForm(board, player)
+        boards.append(board)
+        valids = game.getLegalActions(board, 1)
+        board, player = game.getNextState(board, 1, rnd.choice(list(valids)))
+    pi = [1 / game.getActionSize()] * game.getActionSize()
+
+    def timed(name, f):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for b in boards:
+                f(b)
+        print(f'{name:22s} {(time.perf_counter() - start) / (repeat * len(boards)) * 1e6:8.2f} us')
+
+    timed('build tables', lambda b: ActionTables(n))
+    timed('shared tables', lambda b: actionTables(n))
+    timed('clone', lambda b: b.clone())
+    timed('shortestPathActions', lambda b: b.shortestPathActions())
+    timed('getSymmetries', lambda b: game.getSymmetries(b, pi))
+
+
+def bench_encode(n, positions, repeat):
+    """
+    Compares building the network input of each board with getBoard, as
+    predict used to, with encoding it into preallocated float32 buffers, one
+    board at a time and all at once.
+    """
+    game = Game(n)
+    rnd = random.Random(0)
+    boards = []
+    board, player = game.getInitBoard(), 1
+    while len(boards) < positions:
+        if game.getGameEnded(board, player) != 0:
+            board, player = game.getInitBoard(), 1
+        board = game.getCanonicalForm(board, player)
+        boards.append(board)
+        valids = game.getLegalActions(board, 1)
+        board, player = game.getNextState(board, 1, rnd.choice(list(valids)))
+    pi = [1 / game.getActionSize()] * game.getActionSize()
+    one = featureBuffers(n, 1)
+    batch = featureBuffers(n, 2 * len(boards))
+
+    def timed(name, f, calls=1):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for _ in range(calls):
+                f()
+        print(f'{name:22s} {(time.perf_counter() - start) / (repeat * len(boards)) * 1e6:8.2f} us/board')
+
+    def get_board():
+        for b in boards:
+            [feature.astype(np.float32) for feature in b.getBoard()]
+
+    def encode_one():
+        for b in boards:
+            encodeBoards([b], *one)
+
+    timed('getBoard', get_board)
+    timed('encode one', encode_one)
+    timed('encode batch', lambda: encodeBoards(boards, *batch))
+    timed('encode batch mirror', lambda: encodeBoards(boards, *batch, mirror=True))
+    timed('getSymmetries', lambda: [game.getSymmetries(b, pi) for b in boards])
+
+
+def bench_race(n, positions, repeat):
+    """
+    Times solving the pawn race of positions where both players are out of
+    walls, once per wall configuration, and the lookups that follow.
+    """
+    game = Game(n)
+    rnd = random.Random(0)
+    boards = []
+    while len(boards) < positions:
+        board, player = game.getInitBoard(), 1
+        # walls first, so that the races start early
+        while game.getGameEnded(board, player) == 0 and (board.red_walls or board.blue_walls):
+            legal = game.getLegalActions(game.getCanonicalForm(board, player), 1)
+            board, player = game.getNextState(board, player, rnd.choice(list(legal[-len(legal) // 2:])))
+        if not (board.red_walls or board.blue_walls):
+            boards.append(game.getCanonicalForm(board, player))
+
+    start = time.perf_counter()
+    for b in boards:
+        QuoridorUtils.clearCache()
+        b.raceResult(1)
+    solve = (time.perf_counter() - start) / len(boards)
+
+    for b in boards:
+        b.raceResult(1)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for b in boards:
+            b.raceResult(1)
+    lookup = (time.perf_counter() - start) / (repeat * len(boards))
+    print(f'n {n}  solve {solve * 1e3:8.3f} ms/wall configuration  lookup {lookup * 1e6:6.2f} us')
+
+
+class UniformNet:
+    """
+    Network stand-in with a uniform policy, so that only the search is timed.
+    It reads the network input of the board and returns values shaped like the
+    real wrappers do.
+    """
+
+    def __init__(self, game):
+        self.policy = np.ones(game.getActionSize()) / game.getActionSize()
+
+    def predict(self, board):
+        board.features()
+        return self.policy, np.zeros(1)
+
+    def predict_batch(self, boards):
+        encodeBoards(boards, *featureBuffers(boards[0].n, len(boards)))
+        return np.tile(self.policy, (len(boards), 1)), np.zeros((len(boards), 1))
+
+
+def bench_search(n, sims, repeat, batch):
+    """
+    Times MCTS simulations from the initial position over successive
+    getActionProb calls sharing the tree, evaluating batch leaves at a time,
+    and counts the boards created and the QuoridorUtils calls made per
+    simulation.
+    """
+    game = Game(n)
+    args = dotdict({'numMCTSSims': sims, 'cpuct': 1, 'cpuct_base': 19652, 'cpuct_mult': 2,
+                    'mctsBatchSize': batch})
+    mcts = MCTS(game, UniformNet(game), args)
+    board = game.getCanonicalForm(game.getInitBoard(), 1)
+
+    boards = [0]
+    calls = [0]
+    view = QuoridorBoard.view
+    functions = {name: getattr(QuoridorUtils, name) for name in ('applyAction', 'encodeStates', 'refreshState')}
+
+    def counted_view(self, state=None):
+        boards[0] += 1
+        return view(self, state)
+
+    def counted(function):
+        def call(*args, **kwargs):
+            calls[0] += 1
+            return function(*args, **kwargs)
+        return call
+
+    QuoridorBoard.view = counted_view
+    for name, function in functions.items():
+        setattr(QuoridorUtils, name, counted(function))
+    try:
+        for name in ('first call', 'second call'):
+            boards[0] = calls[0] = 0
+            start = time.perf_counter()
+            for _ in range(repeat):
+                mcts.getActionProb(board)
+            elapsed = time.perf_counter() - start
+            print(f'{name:14s} {elapsed / (sims * repeat) * 1e6:8.1f} us/simulation  '
+                  f'{boards[0] / (sims * repeat):5.2f} boards/simulation  '
+                  f'{calls[0] / (sims * repeat):5.2f} native calls/simulation  {len(mcts.tree)} nodes')
+    finally:
+        QuoridorBoard.view = view
+        for name, function in functions.items():
+            setattr(QuoridorUtils, name, function)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    threads_parser = subparsers.add_parser('threads', help='thread scaling of QuoridorUtils')
+    threads_parser.add_argument('--n', type=int, default=9)
+    threads_parser.add_argument('--positions', type=int, default=200)
+    threads_parser.add_argument('--repeat', type=int, default=200)
+    threads_parser.add_argument('--max-threads', type=int, default=8)
+
+    batch_parser = subparsers.add_parser('batch', help='batched against per position QuoridorUtils calls')
+    batch_parser.add_argument('--n', type=int, default=9)
+    batch_parser.add_argument('--positions', type=int, default=256)
+    batch_parser.add_argument('--repeat', type=int, default=200)
+    batch_parser.add_argument('--threads', type=int, default=0)
+
+    board_parser = subparsers.add_parser('board', help='memory and copy latency of a board')
+    board_parser.add_argument('--n', type=int, default=9)
+    board_parser.add_argument('--positions', type=int, default=1000)
+    board_parser.add_argument('--repeat', type=int, default=20)
+
+    tables_parser = subparsers.add_parser('tables', help='shared against per board action tables')
+    tables_parser.add_argument('--n', type=int, default=9)
+    tables_parser.add_argument('--positions', type=int, default=200)
+    tables_parser.add_argument('--repeat', type=int, default=20)
+
+    encode_parser = subparsers.add_parser('encode', help='network input encoding')
+    encode_parser.add_argument('--n', type=int, default=9)
+    encode_parser.add_argument('--positions', type=int, default=200)
+    encode_parser.add_argument('--repeat', type=int, default=20)
+
+    race_parser = subparsers.add_parser('race', help='pawn race solver')
+    race_parser.add_argument('--n', type=int, default=9)
+    race_parser.add_argument('--positions', type=int, default=50)
+    race_parser.add_argument('--repeat', type=int, default=200)
+
+    search_parser = subparsers.add_parser('search', help='MCTS simulations with a uniform network')
+    search_parser.add_argument('--n', type=int, default=9)
+    search_parser.add_argument('--sims', type=int, default=200)
+    search_parser.add_argument('--repeat', type=int, default=5)
+    search_parser.add_argument('--batch', type=int, default=1, help='leaves per network call')
+
+    args = parser.parse_args()
+    if args.benchmark == 'threads':
+        bench_threads(args.n, args.positions, args.repeat, args.max_threads)
+    elif args.benchmark == 'batch':
+        bench_batch(args.n, args.positions, args.repeat, args.threads)
+    elif args.benchmark == 'board':
+        bench_board(args.n, args.positions, args.repeat)
+    elif args.benchmark == 'tables':
+        bench_tables(args.n, args.positions, args.repeat)
+    elif args.benchmark == 'encode':
+        bench_encode(args.n, args.positions, args.repeat)
+    elif args.benchmark == 'race':
+        bench_race(args.n, args.positions, args.repeat)
+    elif args.benchmark == 'search':
+        bench_search(args.n, args.sims, args.repeat, args.batch)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from alphazero_general import MCTS, MCTSQuoridor
+from alphazero_general.utils import dotdict
+from quoridor.QuoridorGame import QuoridorGame
+
+"""
+Checks of the MCTS statistics. Run them from src/, e.g. python -m pytest tests
+"""
+
+
+class ShapedNet:
+    """
+    Network stand-in returning a uniform policy and values of shape (1,), as
+    NNetWrapper.predict does, that depend on the position
+    """
+
+    def __init__(self, game):
+        self.policy = np.ones(game.getActionSize()) / game.getActionSize()
+
+    def predict(self, board):
+        return self.policy, np.tanh(board.features()[2][0, 14:15] - board.features()[2][0, 15:16])
+
+    def predict_batch(self, boards):
+        pis, vs = zip(*(self.predict(board) for board in boards))
+        return np.array(pis), np.array(vs)
+
+
+@pytest.mark.filterwarnings('error')
+@pytest.mark.parametrize('module', [MCTS, MCTSQuoridor])
+@pytest.mark.parametrize('batch_size', [1, 8])
+def test_search_backs_up_array_values(module, batch_size):
+    game = QuoridorGame(5)
+    args = dotdict({'numMCTSSims': 200, 'cpuct': 1, 'cpuct_base': 19652, 'cpuct_mult': 2,
+                    'dirichlet_alpha': 0.3, 'eps': 0.25, 'mctsBatchSize': batch_size})
+    mcts = module.MCTS(game, ShapedNet(game), args)
+    board = game.getCanonicalForm(game.getInitBoard(), 1)
+    mcts.getActionProb(board)
+
+    tree = mcts.tree
+    # the first simulation only expands the root
+    root = tree.find(game.stringRepresentation(board))
+    assert tree.counts(root, game.getActionSize()).sum() == args.numMCTSSims - 1
+    for node in range(len(tree)):
+        if tree.is_expanded(node):
+            edges = tree.edges(node)
+            assert tree.visits[node] == tree.edge_visits[edges].sum()
+            assert np.all(np.abs(tree.value_sums[edges]) <= tree.edge_visits[edges])
+    assert np.any(tree.value_sums[:tree.num_edges] != 0)
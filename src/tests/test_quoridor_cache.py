@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+from quoridor.QuoridorGame import QuoridorGame
+from quoridor.QuoridorLogic import QuoridorUtils
+
+"""
+Checks of the entry budgets of the QuoridorUtils caches. Run them from src/,
+e.g. python -m pytest tests
+"""
+
+
+@pytest.mark.parametrize('n', [5, 9])
+def test_cache_capacity_enforced(n):
+    game = QuoridorGame(n)
+    rng = random.Random(n)
+    saved = {name: stats['capacity'] for name, stats in QuoridorUtils.cacheStats().items()}
+    try:
+        QuoridorUtils.clearCache()
+        QuoridorUtils.setCacheCapacity(8, race_entries=2)
+        for _ in range(5):
+            board = game.getInitBoard()
+            player = 1
+            for move in range(40):
+                legal = game.getLegalActions(game.getCanonicalForm(board, player), 1)
+                board, player = game.getNextState(board, player, rng.choice(legal.tolist()))
+                # solves the pawn race for the walls placed so far
+                board.raceResult(player)
+                if game.getGameEnded(board, player) != 0:
+                    break
+
+        stats = QuoridorUtils.cacheStats()
+        for name, capacity in [('paths', 8), ('walls', 8), ('race', 2)]:
+            assert stats[name]['capacity'] == capacity, name
+            assert stats[name]['misses'] > capacity, name
+            assert stats[name]['entries'] == capacity, name
+
+        # shrinking evicts at once, and leaving race_entries out keeps its budget
+        QuoridorUtils.setCacheCapacity(1)
+        stats = QuoridorUtils.cacheStats()
+        assert [stats[name]['entries'] for name in ('paths', 'walls', 'race')] == [1, 1, 2]
+        QuoridorUtils.setCacheCapacity(0, race_entries=0)
+        assert all(stats['entries'] == 0 for stats in QuoridorUtils.cacheStats().values())
+    finally:
+        QuoridorUtils.setCacheCapacity(saved['paths'], race_entries=saved['race'])
+        QuoridorUtils.clearCache()
@@ -0,0 +1,47 @@
+import random
+
+import numpy as np
+import pytest
+
+from quoridor.QuoridorGame import QuoridorGame
+from quoridor.QuoridorLogic import QuoridorBoard, QuoridorUtils
+
+"""
+Checks of the state kept up to date by QuoridorUtils.applyAction. Run them from
+src/, e.g. python -m pytest tests
+"""
+
+
+def assert_state_current(board):
+    """
+    Valid actions of board, and its legal walls while some are left to place,
+    match a full recompute of its state
+    """
+    full = board.view(board.state.copy())
+    QuoridorUtils.refreshState(full.state, board.n)
+    fields = ['valid_red', 'valid_blue']
+    if board.red_walls > 0 or board.blue_walls > 0:
+        fields += ['legal_vwalls', 'legal_hwalls']
+    for field in fields:
+        assert np.array_equal(getattr(board, field), getattr(full, field)), field
+
+
+@pytest.mark.parametrize('n', [5, 7, 9])
+def test_incremental_walls_toggled_mid_game(n):
+    # Moves 2 to 4 recompute legal walls from scratch, the next ones go on
+    # incrementally from the cut sets they left
+    game = QuoridorGame(n)
+    rng = random.Random(n)
+    try:
+        for _ in range(150):
+            board = game.getInitBoard()
+            player = 1
+            for move in range(60):
+                QuoridorBoard.incremental_walls = not 2 <= move <= 4
+                legal = game.getLegalActions(game.getCanonicalForm(board, player), 1)
+                board, player = game.getNextState(board, player, rng.choice(legal.tolist()))
+                assert_state_current(board)
+                if game.getGameEnded(board, player) != 0:
+                    break
+    finally:
+        QuoridorBoard.incremental_walls = True